@@ -1,54 +1,62 @@
 from os import path
 from copy import copy
 from lib.constants import *
+from lib.text import get_text_match_index, get_spec_name
 from threading import Lock
 import json
 
-GRABBABLE_SPECS: list[dict] = []
+# Snapshots, replaced as a whole when a language is loaded and never modified afterwards, so that they can be read without a lock.
+# The lock only keeps concurrent loads from interleaving.
+GRABBABLE_SPECS: tuple[dict, ...] = ()
+GRABBABLE_SPECS_BY_ID: dict[int | str, dict] = {}  # Armament ids are integers, item and talisman ids are prefixed strings
 GRABBABLE_SPECS_LOCK: Lock = Lock()
 
 
 def load_all_grabbable_specs(resources_path: str, language: str = DEFAULT_LANGUAGE) -> None:
-    global GRABBABLE_SPECS, GRABBABLE_SPECS_LOCK
+    global GRABBABLE_SPECS, GRABBABLE_SPECS_BY_ID, GRABBABLE_SPECS_LOCK
+    # The specs and their index are built aside, and swapped in together, so that readers never see a partially loaded language
+    grabbable_specs: list[dict] = []
+    with open(path.join(resources_path, "armaments.json"), "r", encoding="utf-8") as file:
+        armament_data = json.load(file)
+        for armament in armament_data:
+            grabbable_spec = copy(armament)
+            grabbable_spec["name"] = armament["name"][language]
+            grabbable_spec["type"] = "armament"
+            grabbable_spec["armament_type"] = armament["type"]
+            grabbable_specs.append(grabbable_spec)
+    with open(path.join(resources_path, "items.json"), "r", encoding="utf-8") as file:
+        item_data = json.load(file)
+        for item in item_data:
+            grabbable_specs.append(
+                {
+                    "id": f"i{item['id']}",
+                    "name": item["name"][language],
+                    "type": "item",
+                }
+            )
+    with open(path.join(resources_path, "talismans.json"), "r", encoding="utf-8") as file:
+        talisman_data = json.load(file)
+        for talisman in talisman_data:
+            grabbable_specs.append(
+                {
+                    "id": f"t{talisman['id']}",
+                    "name": talisman["name"][language],
+                    "type": "talisman",
+                }
+            )
+    grabbable_specs_by_id: dict[int | str, dict] = {}
+    for grabbable_spec in grabbable_specs:
+        grabbable_specs_by_id.setdefault(grabbable_spec["id"], grabbable_spec)  # The first spec with an id wins, as with a linear search
     with GRABBABLE_SPECS_LOCK:
-        GRABBABLE_SPECS.clear()
-        with open(path.join(resources_path, "armaments.json"), "r", encoding="utf-8") as file:
-            armament_data = json.load(file)
-            for armament in armament_data:
-                grabbable_spec = copy(armament)
-                grabbable_spec["name"] = armament["name"][language]
-                grabbable_spec["type"] = "armament"
-                grabbable_spec["armament_type"] = armament["type"]
-                GRABBABLE_SPECS.append(grabbable_spec)
-        with open(path.join(resources_path, "items.json"), "r", encoding="utf-8") as file:
-            item_data = json.load(file)
-            for item in item_data:
-                GRABBABLE_SPECS.append(
-                    {
-                        "id": f"i{item['id']}",
-                        "name": item["name"][language],
-                        "type": "item",
-                    }
-                )
-        with open(path.join(resources_path, "talismans.json"), "r", encoding="utf-8") as file:
-            talisman_data = json.load(file)
-            for talisman in talisman_data:
-                GRABBABLE_SPECS.append(
-                    {
-                        "id": f"t{talisman['id']}",
-                        "name": talisman["name"][language],
-                        "type": "talisman",
-                    }
-                )
+        GRABBABLE_SPECS = tuple(grabbable_specs)
+        GRABBABLE_SPECS_BY_ID = grabbable_specs_by_id
+    # The names are normalized when the specs are loaded rather than on the first match, the index is kept in the text match indexes
+    get_text_match_index(GRABBABLE_SPECS, get_spec_name, language)
 
 
-def find_grabbable_name_by_id(grabbable_id: str) -> str:
-    with GRABBABLE_SPECS_LOCK:
-        for grabbable in GRABBABLE_SPECS:
-            if grabbable["id"] == grabbable_id:
-                return grabbable["name"]
-    return ""
+def find_grabbable_name_by_id(grabbable_id: int | str) -> str:
+    grabbable: dict | None = GRABBABLE_SPECS_BY_ID.get(grabbable_id)
+    return grabbable["name"] if grabbable is not None else ""
 
-def get_all_grabbable_specs() -> list[dict]:
-    with GRABBABLE_SPECS_LOCK:
-        return GRABBABLE_SPECS.copy()
+def get_all_grabbable_specs() -> tuple[dict, ...]:
+    return GRABBABLE_SPECS
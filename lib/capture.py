@@ -0,0 +1,142 @@
+from abc import ABC, abstractmethod
+from threading import Condition, local
+from typing import Callable
+from numpy import ndarray, array
+from PIL import Image, ImageGrab
+from cv2 import cvtColor, VideoCapture, COLOR_BGR2GRAY, COLOR_BGR2RGB
+from os import path, listdir
+import mss
+
+RECORDED_FRAME_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+# Screen bounding box of a captured region: (left, top, right, bottom)
+Region = tuple[int, int, int, int]
+
+
+class Frame:
+    def __init__(self, sequence: int, timestamp: float, regions: list[tuple[Region, Image.Image]], screen_width: int, screen_height: int):
+        self.sequence: int = sequence
+        self.timestamp: float = timestamp
+        # Width and height always refer to the whole screen, even when only some regions of it were captured
+        self.width: int = screen_width
+        self.height: int = screen_height
+        # The grayscale planes are computed once per frame and shared (read-only) by every detector
+        self.regions: list[tuple[int, int, ndarray]] = []
+        for (left, top, _, _), img in regions:
+            gray: ndarray = cvtColor(array(img), COLOR_BGR2GRAY)
+            gray.setflags(write=False)
+            self.regions.append((left, top, gray))
+
+    @classmethod
+    def full(cls, sequence: int, timestamp: float, img: Image.Image) -> "Frame":
+        return cls(sequence, timestamp, [((0, 0, img.width, img.height), img)], img.width, img.height)
+
+    def crop(self, top: int, bottom: int, left: int, right: int) -> ndarray | None:
+        # Coordinates are given in screen space, and translated to the captured region that contains them
+        for region_left, region_top, gray in self.regions:
+            if top >= region_top and left >= region_left and bottom <= region_top + gray.shape[0] and right <= region_left + gray.shape[1]:
+                return gray[top - region_top : bottom - region_top, left - region_left : right - region_left]
+        return None
+
+
+class FrameBus:
+    def __init__(self):
+        self.condition: Condition = Condition()
+        self.frame: Frame | None = None
+
+    def publish(self, frame: Frame) -> None:
+        with self.condition:
+            self.frame = frame
+            self.condition.notify_all()
+
+    def latest(self) -> Frame | None:
+        return self.frame
+
+    def wait_for_frame(self, after_sequence: int = -1, timeout: float | None = None) -> Frame | None:
+        # Returns the latest frame with a sequence number greater than after_sequence, or None on timeout
+        with self.condition:
+            self.condition.wait_for(lambda: self.frame is not None and self.frame.sequence > after_sequence, timeout)
+            if self.frame is None or self.frame.sequence <= after_sequence:
+                return None
+            return self.frame
+
+
+class FrameSource(ABC):
+    # Stands in for ImageGrab.grab(), returns None once there are no more frames to provide.
+    @abstractmethod
+    def grab(self, bbox: Region | None = None) -> Image.Image | None:
+        pass
+
+    def grab_regions(self, get_regions: Callable[[int, int], list[Region]]) -> tuple[int, int, list[tuple[Region, Image.Image]]] | None:
+        # Returns the screen dimensions and the regions that get_regions asks for, given those dimensions.
+        # By default the whole frame is grabbed once, and the regions are cropped from it.
+        img = self.grab()
+        if img is None:
+            return None
+        return img.width, img.height, [(region, img.crop(region)) for region in get_regions(img.width, img.height)]
+
+    def close(self) -> None:
+        pass
+
+
+class ScreenFrameSource(FrameSource):
+    def __init__(self):
+        self.local = local()  # mss instances can only be used by the thread that created them
+
+    def grab(self, bbox: Region | None = None) -> Image.Image | None:
+        return ImageGrab.grab(bbox=bbox)
+
+    def grab_regions(self, get_regions: Callable[[int, int], list[Region]]) -> tuple[int, int, list[tuple[Region, Image.Image]]] | None:
+        # ImageGrab always grabs the whole screen and then crops it, mss grabs only the requested regions
+        screen = getattr(self.local, "screen", None)
+        if screen is None:
+            screen = self.local.screen = mss.MSS()
+        monitor = screen.monitors[1]  # Primary screen, the one ImageGrab.grab() captures
+        regions: list[tuple[Region, Image.Image]] = []
+        for left, top, right, bottom in get_regions(monitor["width"], monitor["height"]):
+            area = {"left": monitor["left"] + left, "top": monitor["top"] + top, "width": right - left, "height": bottom - top}
+            shot = screen.grab(area)
+            regions.append(((left, top, right, bottom), Image.frombytes("RGB", shot.size, shot.bgra, "raw", "BGRX")))
+        return monitor["width"], monitor["height"], regions
+
+
+class DirectoryFrameSource(FrameSource):
+    def __init__(self, directory_path: str):
+        filenames = sorted(filename for filename in listdir(directory_path) if filename.lower().endswith(RECORDED_FRAME_EXTENSIONS))
+        self.filepaths: list[str] = [path.join(directory_path, filename) for filename in filenames]
+        self.index: int = 0
+
+    def grab(self, bbox: Region | None = None) -> Image.Image | None:
+        if self.index >= len(self.filepaths):
+            return None
+        with open(self.filepaths[self.index], mode="rb") as file:
+            img = Image.open(file).convert("RGB")
+        self.index += 1
+        return img.crop(bbox) if bbox is not None else img
+
+
+class VideoFrameSource(FrameSource):
+    def __init__(self, video_path: str):
+        self.video: VideoCapture = VideoCapture(video_path)
+        if not self.video.isOpened():
+            raise ValueError(f"Unable to open video: {video_path}")
+
+    def grab(self, bbox: Region | None = None) -> Image.Image | None:
+        success, frame = self.video.read()
+        if not success:
+            return None
+        # Videos are decoded as BGR, while screen grabs are RGB
+        img = Image.fromarray(cvtColor(frame, COLOR_BGR2RGB))
+        return img.crop(bbox) if bbox is not None else img
+
+    def close(self) -> None:
+        self.video.release()
+
+
+def open_frame_source(source_path: str) -> FrameSource:
+    if path.isdir(source_path):
+        return DirectoryFrameSource(source_path)
+    if path.isfile(source_path):
+        return VideoFrameSource(source_path)
+    raise FileNotFoundError(f"Recorded frames not found: {source_path}")
@@ -1,52 +1,61 @@
 from os import path
 from lib.constants import *
+from lib.text import get_text_match_index, get_spec_name
 from threading import Lock
 import json
 
 # Changed DEX from B to A for DUCHESS due to the real stats actually being 1 point apart.
-CHARACTER_SPECS: list[dict] = []
+# Snapshots, replaced as a whole when a language is loaded and never modified afterwards, so that they can be read without a lock.
+# The lock only keeps concurrent loads from interleaving.
+CHARACTER_SPECS: tuple[dict, ...] = ()
+CHARACTER_NAMES: tuple[str, ...] = ()
+CHARACTER_SPECS_BY_ID: dict[int, dict] = {}
+CHARACTER_SPECS_BY_NAME: dict[str, dict] = {}
 CHARACTER_SPECS_LOCK: Lock = Lock()
 
 def load_all_character_specs(resources_path: str, language: str = DEFAULT_LANGUAGE) -> None:
-    global CHARACTER_SPECS
+    global CHARACTER_SPECS, CHARACTER_NAMES, CHARACTER_SPECS_BY_ID, CHARACTER_SPECS_BY_NAME
+    # The specs and their indexes are built aside, and swapped in together, so that readers never see a partially loaded language
+    character_specs: list[dict] = []
+    with open(path.join(resources_path, "characters.json"), "r", encoding="utf-8") as file:
+        character_data = json.load(file)
+        for character in character_data:
+            character_specs.append(
+                {
+                    "id": character["id"],
+                    "name": character["name"][language],
+                    "armament_types": character["armament_types"],
+                    "STR": character["STR"],
+                    "DEX": character["DEX"],
+                    "INT": character["INT"],
+                    "FAI": character["FAI"],
+                    "ARC": character["ARC"]
+                }
+            )
+    character_specs_by_id: dict[int, dict] = {}
+    character_specs_by_name: dict[str, dict] = {}
+    for character in character_specs:
+        # The first character with an id or a name wins, as with a linear search
+        character_specs_by_id.setdefault(character["id"], character)
+        character_specs_by_name.setdefault(character["name"], character)
     with CHARACTER_SPECS_LOCK:
-        CHARACTER_SPECS.clear()
-        with open(path.join(resources_path, "characters.json"), "r", encoding="utf-8") as file:
-            character_data = json.load(file)
-            for character in character_data:
-                CHARACTER_SPECS.append(
-                    {
-                        "id": character["id"],
-                        "name": character["name"][language],
-                        "armament_types": character["armament_types"],
-                        "STR": character["STR"],
-                        "DEX": character["DEX"],
-                        "INT": character["INT"],
-                        "FAI": character["FAI"],
-                        "ARC": character["ARC"]
-                    }
-                )
+        CHARACTER_SPECS = tuple(character_specs)
+        CHARACTER_NAMES = tuple(character["name"] for character in character_specs)
+        CHARACTER_SPECS_BY_ID = character_specs_by_id
+        CHARACTER_SPECS_BY_NAME = character_specs_by_name
+    # The names are normalized when the specs are loaded rather than on the first match, the index is kept in the text match indexes
+    get_text_match_index(CHARACTER_SPECS, get_spec_name, language)
 
 
 def find_character_by_name(character_name: str) -> dict | None:
-    with CHARACTER_SPECS_LOCK:
-        for character in CHARACTER_SPECS:
-            if character["name"] == character_name:
-                return character
-    return None
+    return CHARACTER_SPECS_BY_NAME.get(character_name)
 
 def find_character_by_id(character_id: int) -> dict | None:
-    with CHARACTER_SPECS_LOCK:
-        for character in CHARACTER_SPECS:
-            if character["id"] == character_id:
-                return character
-    return None
+    return CHARACTER_SPECS_BY_ID.get(character_id)
 
 
-def get_all_character_specs() -> list[dict]:
-    with CHARACTER_SPECS_LOCK:
-        return CHARACTER_SPECS.copy()
+def get_all_character_specs() -> tuple[dict, ...]:
+    return CHARACTER_SPECS
 
-def get_all_character_names() -> list[str]:
-    with CHARACTER_SPECS_LOCK:
-        return [character["name"] for character in CHARACTER_SPECS]
\ No newline at end of file
+def get_all_character_names() -> tuple[str, ...]:
+    return CHARACTER_NAMES
\ No newline at end of file
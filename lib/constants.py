@@ -1,5 +1,5 @@
 PROGRAM_NAME = "Nightreign Armament Helper"
-VERSION = "2.4.1"
+VERSION = "2.6.0"
 
 TEXT_ORIGINS: list[int] = [
     TEXT_ORIGIN_NONE := 0,
@@ -112,9 +112,48 @@ PIXELSET_THRESHOLD_REDUCTIONS = {
     MENU_DETECTION: 10,
     CHARACTER_DETECTION: 0,
 }
+# Maximum offset in pixels (in both axes) between a pixel set and a reference for them to still be compared
+PIXELSET_SHIFT_TOLERANCES = {
+    ARMAMENT_DETECTION_DEFAULT: 1,
+    ARMAMENT_DETECTION_DEFAULT_REPLACE: 1,
+    ARMAMENT_DETECTION_BOSS_DROP: 1,
+    ARMAMENT_DETECTION_SHOP: 1,
+    MENU_DETECTION: 1,
+    CHARACTER_DETECTION: 1,
+}
+# Number of vertical bands in the coarse signature used to discard pixel sets before comparing them
+PIXELSET_SIGNATURE_BANDS = 16
+# Pixel sets are learned and matched at the scale of this resolution, whatever the actual screen resolution is
+PIXELSET_CANONICAL_RESOLUTION = "1920x1080"
+# Time in seconds that the background writer waits to batch learned pixel sets before writing them
+PIXELSET_WRITE_DELAY = 1.0
+# Number of threads running OCR reads
+OCR_WORKERS = 2
+# Time in seconds between checks for a newer frame while waiting for an OCR read
+OCR_WAIT_SLICE = 0.05
+# Number of OCR reads whose text is remembered, by image digest
+OCR_RESULT_CACHE_SIZE = 4096
+# Number of OCR texts whose match is remembered
+MATCH_CACHE_SIZE = 512
 # Time in seconds between detection checks
 MINIMUM_TIME_BETWEEN_SCREENGRABS = 0.1
 
+CAPTURE_MODES: list[str] = [
+    CAPTURE_MODE_FULL := "full",  # Grab the whole screen on every capture
+    CAPTURE_MODE_REGION := "region",  # Grab only the regions read by the active detectors and the button check
+]
+# Regions closer than this (relative to the screen height) are grabbed together, fewer grabs for a few more pixels
+CAPTURE_REGION_MERGE_DISTANCE = 0.03
+
+DETECTION_OUTCOMES: list[str] = [
+    DETECTION_OUTCOME_SKIPPED := "skipped",  # Nothing worth reading in the detection box
+    DETECTION_OUTCOME_UNCHANGED := "unchanged",  # Same image as the previous detection, previous result reused
+    DETECTION_OUTCOME_PIXELSET := "pixelset",
+    DETECTION_OUTCOME_OCR := "ocr",
+    DETECTION_OUTCOME_OCR_CACHE := "ocr_cache",  # Same image as a previous OCR read, its text was reused
+    DETECTION_OUTCOME_ABANDONED := "abandoned",  # The detection box changed while its OCR was running, the result was not waited for
+]
+
 DETECTION_LOOP_PERIODS = {
     ARMAMENT_DETECTION_DEFAULT: 0.2,
     ARMAMENT_DETECTION_DEFAULT_REPLACE: 0.2,
@@ -133,6 +172,12 @@ OCR_THRESHOLDS = {
 
 TESSERACT_CONFIG = f"--oem 3 --psm 7 -c language_model_penalty_non_freq_dict_word=1 -c language_model_penalty_non_dict_word=1 -c tessedit_do_invert=0"
 TESSERACT_TIMEOUT = 2  # seconds
+# Images given to Tesseract are trimmed to their text, rescaled so that the text line is this many pixels tall (Tesseract reads best
+# with capital letters around 30 pixels tall), and surrounded by a white margin
+OCR_TEXT_HEIGHT = 36  # pixels
+OCR_TEXT_MARGIN = 10  # pixels
+OCR_MIN_SCALE = 0.25  # Bounds the rescaling when the trimmed area is not only text (ex: bright background elements)
+OCR_MAX_SCALE = 4.0
 
 NO_CHARACTER = "_____"
 
@@ -8,7 +8,7 @@ from lib.constants import *
 
 
 class DebugWindow:
-    def __init__(self, root: Tk, debug: bool, debug_path: str) -> None:
+    def __init__(self, root: Tk | None, debug: bool, debug_path: str) -> None:
         self.debug = debug
         self.debug_path = debug_path
         if not debug:
@@ -0,0 +1,71 @@
+from numpy import ndarray
+from cv2 import threshold, THRESH_BINARY_INV
+from typing import Any, Callable
+from lib.constants import *
+from lib.characters import get_all_character_specs
+from lib.armaments import get_all_grabbable_specs
+from lib.misc import convert_menu_title_to_state
+from lib.text import get_text_itself, get_spec_name, get_spec_id
+from lib.pixelsets import PixelSet
+
+# Steps of the detection shared by the live detection (main.py) and the trainer (lib/trainer.py), so that the pixel sets
+# learned from recorded frames are the same as the ones that would have been learned live.
+
+# Menu titles of every language, always the same tuples so that the matches against them are cached (see find_match)
+MENU_TITLES: dict[str, tuple[str, str]] = {language: (DORMANT_POWER_LANGUAGES[language], SHOP_LANGUAGES[language]) for language in DORMANT_POWER_LANGUAGES}
+
+
+def get_ocr_image(cropped: ndarray) -> ndarray:
+    # Image of the detection box as given to the OCR (dark text on a white background)
+    _, img_for_ocr = threshold(cropped, 115, 255, THRESH_BINARY_INV)
+    return img_for_ocr
+
+
+def has_enough_pixels(pixel_set: PixelSet, detection_id: str) -> bool:
+    # If the detection area contains too few relevant colored pixels, we assume that the OCR will be unable to detect anything useful.
+    return pixel_set.size() / (pixel_set.width * pixel_set.height) >= OCR_MINIMUM_PIXELS_PERCENTS[detection_id]
+
+
+def get_effective_detection_id(detection_id: str, menu_state: str) -> str | None:
+    # The detection box that is actually read for a detection in the given menu state (ex: the shop shows its armament elsewhere),
+    # or None if there is nothing to read (ex: there is no armament to replace in a menu)
+    if detection_id == ARMAMENT_DETECTION_DEFAULT_REPLACE:
+        return ARMAMENT_DETECTION_DEFAULT_REPLACE if menu_state == MENU_STATE_DEFAULT else None
+    elif detection_id == ARMAMENT_DETECTION_DEFAULT:
+        if menu_state == MENU_STATE_SHOP:
+            return ARMAMENT_DETECTION_SHOP
+        elif menu_state == MENU_STATE_DORMANT_POWER:
+            return ARMAMENT_DETECTION_BOSS_DROP
+    return detection_id
+
+
+def get_armament_detection_ids(menu_state: str) -> list[str]:
+    # Every armament detection box that is read in the given menu state
+    detection_ids = [get_effective_detection_id(detection_id, menu_state) for detection_id in (ARMAMENT_DETECTION_DEFAULT, ARMAMENT_DETECTION_DEFAULT_REPLACE)]
+    return [detection_id for detection_id in detection_ids if detection_id is not None]
+
+
+def get_search_space(detection_id: str, language: str) -> tuple[tuple, Callable]:
+    # Items that the text read in a detection box is matched against, with the getter of their text
+    if detection_id == MENU_DETECTION:
+        return (MENU_TITLES[language], get_text_itself)
+    elif detection_id == CHARACTER_DETECTION:
+        return (get_all_character_specs(), get_spec_name)
+    return (get_all_grabbable_specs(), get_spec_name)
+
+
+def get_menu_state(match_result: int, match: Any) -> str:
+    return convert_menu_title_to_state(match) if match_result != NO_MATCH else MENU_STATE_DEFAULT
+
+
+def get_pixelset_identifier(detection_id: str, text_origin: int, match_result: int, match: Any) -> int | str | None:
+    # Identifier that the pixel set of a detection is learned under, or None if it must not be learned.
+    # Only the texts read by the OCR that perfectly match an item are learned, under what the pixel set is resolved to when found again
+    # (see resolve_pixelset_identifier): the menu title, the character name, or the grabbable id.
+    if text_origin != TEXT_ORIGIN_OCR or match_result != PERFECT_MATCH:
+        return None
+    if detection_id == MENU_DETECTION:
+        return get_text_itself(match)
+    elif detection_id == CHARACTER_DETECTION:
+        return get_spec_name(match)
+    return get_spec_id(match)
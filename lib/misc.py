@@ -1,15 +1,15 @@
-from imagehash import average_hash, ImageHash
-from textdistance import jaccard
-from numpy import ndarray, where, array
+from numpy import ndarray, where, array, count_nonzero, zeros, clip, rint, float64
 from PIL import Image
 from os import path, makedirs, listdir
-from cv2 import threshold, matchTemplate, resize, THRESH_BINARY, TM_CCOEFF_NORMED, INTER_AREA
-from lib.characters import get_all_character_names
+from cv2 import threshold, matchTemplate, resize, bitwise_and, THRESH_BINARY, TM_CCOEFF_NORMED, INTER_AREA
 from lib.constants import *
 from lib.armaments import *
-from re import sub
+from lib.text import *
 from typing import Iterable, Any, Callable
-from math import ceil
+from math import ceil, sin, pi
+from threading import Lock
+from functools import lru_cache
+from collections import OrderedDict
 import importlib.util
 from inspect import getfullargspec
 import sys
@@ -86,27 +86,35 @@ def load_extensions(extensions_path: str, extensible_function_specs: dict[str, A
     return (ext_config["mode"], loaded_extensions)
 
 
-def text_matches(rough_text: str, target_text: str, detection_id: str, language: str) -> tuple[int, float]:
-    threshold: float = TEXT_SIMILARITY_THRESHOLDS[detection_id]
-    clean_target_text: str = target_text.strip().upper()
-    if language == "engus":  # Optimizations for the default language (English)
-        clean_target_text = clean_target_text.replace("É", "E").replace("é", "E")
-        clean_target_text = sub(r"[^a-zA-Z\s\'\-\.]", "", clean_target_text)  # Will mainly remove: []0-9
+class MatchCache:
+    # Bounded LRU of the matches found for OCR texts, so that a text that keeps being read (ex: a recurring misread) is only matched once.
+    # Entries keep the search space they were found in, and are only used for that same search space.
+    def __init__(self, max_size: int):
+        self.lock: Lock = Lock()
+        self.max_size: int = max_size
+        self.entries: OrderedDict[tuple[str, str, str, bool, Any], tuple[tuple, tuple[int, Any]]] = OrderedDict()
 
-    clean_rough_text: str = rough_text.strip().upper()
-    if language == "engus":  # Optimizations for the default language (English)
-        clean_rough_text = clean_rough_text.replace("’", "'").replace("‘", "'")
-        clean_rough_text = clean_rough_text.replace("!", "L").replace("+", "T")
-        clean_rough_text = clean_rough_text.replace("É", "E").replace("é", "E")
-        clean_rough_text = sub(r"[^a-zA-Z\s\'\-\.]", "", clean_rough_text)
-    clean_rough_text = sub(r"\s+", " ", clean_rough_text)
+    def get(self, key: tuple[str, str, str, bool, Any], search_space: tuple) -> tuple[int, Any] | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] is not search_space:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
 
-    similarity = jaccard.normalized_similarity(clean_rough_text, clean_target_text)
-    if similarity >= threshold:
-        if clean_rough_text == clean_target_text:
-            return (PERFECT_MATCH, 1)
-        return (GOOD_MATCH, similarity)
-    return (NO_MATCH, 0)
+    def put(self, key: tuple[str, str, str, bool, Any], search_space: tuple, match: tuple[int, Any]) -> None:
+        with self.lock:
+            self.entries[key] = (search_space, match)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+MATCH_CACHE: MatchCache = MatchCache(MATCH_CACHE_SIZE)
 
 
 def find_match(
@@ -120,40 +128,79 @@ def find_match(
             if text == item_text:
                 return (PERFECT_MATCH, item)
     if text_origin == TEXT_ORIGIN_OCR:
-        best_match: Any = None
-        best_match_similarity: float = 0.0
-        for item in search_space:
-            item_text: str = get_text(item)
-            match_result, similarity = text_matches(text, item_text, detection_id, language)
-            if match_result == PERFECT_MATCH:
-                return (PERFECT_MATCH, item)
-            elif match_result == GOOD_MATCH:
-                if exhaustive:
-                    if similarity > best_match_similarity:
-                        best_match = item
-                        best_match_similarity = similarity
-                else:
-                    return (match_result, item)
-        if exhaustive and best_match is not None:
-            return (GOOD_MATCH, best_match)
+        # Only immutable search spaces (ex: the spec snapshots) are cached, since a match can only be reused for the same search space
+        # get_text must be a module-level function (see get_spec_name), as with the text match indexes
+        cache_key = (language, detection_id, text, exhaustive, get_text)
+        if isinstance(search_space, tuple):
+            cached_match = MATCH_CACHE.get(cache_key, search_space)
+            if cached_match is not None:
+                return cached_match
+        # Same result as scoring every item in order (see TextMatchIndex.find), but only the items that can reach the threshold are scored
+        if isinstance(search_space, tuple):
+            items: tuple = search_space
+            index: TextMatchIndex = get_text_match_index(items, get_text, language)
+        else:
+            items = tuple(search_space)
+            index = TextMatchIndex((get_text(item) for item in items), language)
+        # The OCR text is only normalized once, the texts of the search space were normalized when indexed
+        match_result, position = index.find(normalize_ocr_text(text, language), TEXT_SIMILARITY_THRESHOLDS[detection_id], exhaustive)
+        match: tuple[int, Any] = (match_result, items[position]) if match_result != NO_MATCH else (NO_MATCH, None)
+        if isinstance(search_space, tuple):
+            MATCH_CACHE.put(cache_key, search_space, match)
+        return match
     return (NO_MATCH, None)
 
 
-def get_image_difference(previous_img: ndarray | None, current_img: ndarray) -> float:
-    if previous_img is None:
-        return 1.0  # If no previous image, consider it a full change
+def convert_menu_title_to_state(title: str) -> str:
+    if title in SHOP_LANGUAGES.values():
+        return MENU_STATE_SHOP
+    elif title in DORMANT_POWER_LANGUAGES.values():
+        return MENU_STATE_DORMANT_POWER
+    return MENU_STATE_DEFAULT
 
-    pil_current_img: Image.Image = Image.fromarray(current_img)
-    pil_previous_img: Image.Image = Image.fromarray(previous_img)
 
-    hash0: ImageHash = average_hash(pil_current_img)
-    hash1: ImageHash = average_hash(pil_previous_img)
+def lanczos(x: float) -> float:
+    if -3.0 <= x < 3.0:
+        sinc_x = sin(pi * x) / (pi * x) if x != 0 else 1.0
+        sinc_x3 = sin(pi * x / 3.0) / (pi * x / 3.0) if x != 0 else 1.0
+        return sinc_x * sinc_x3
+    return 0.0
 
-    return hash0 - hash1  # Returns the distance between the hashes of images
 
+@lru_cache(maxsize=None)
+def get_lanczos_coefficients(in_size: int, out_size: int) -> ndarray:
+    # Same resampling weights as PIL's Image.resize with LANCZOS, as a (out_size x in_size) matrix
+    scale: float = in_size / out_size
+    filter_scale: float = max(scale, 1.0)
+    support: float = 3.0 * filter_scale
+    coefficients: ndarray = zeros((out_size, in_size), dtype=float64)
+    for out_x in range(out_size):
+        center = (out_x + 0.5) * scale
+        x_min = max(int(center - support + 0.5), 0)
+        x_max = min(int(center + support + 0.5), in_size)
+        weights = [lanczos((x - center + 0.5) / filter_scale) for x in range(x_min, x_max)]
+        total = sum(weights)
+        coefficients[out_x, x_min:x_max] = [weight / total for weight in weights]
+    coefficients.setflags(write=False)
+    return coefficients
 
-def are_images_different(previous_img: ndarray | None, current_img: ndarray, cutoff: int = 1) -> bool:
-    return get_image_difference(previous_img, current_img) >= cutoff
+
+def get_image_hash(img: ndarray, hash_size: int = 8) -> ndarray:
+    # Average hash of a grayscale image, identical to imagehash.average_hash, but computed directly on the ndarray
+    # with two matrix products instead of going through PIL.
+    horizontal: ndarray = clip(rint(img.astype(float64) @ get_lanczos_coefficients(img.shape[1], hash_size).T), 0, 255)
+    small: ndarray = clip(rint(get_lanczos_coefficients(img.shape[0], hash_size) @ horizontal), 0, 255)
+    return (small > small.mean()).ravel()
+
+
+def get_hash_difference(previous_hash: ndarray | None, current_hash: ndarray) -> int:
+    if previous_hash is None:
+        return current_hash.size  # If no previous hash, consider it a full change
+    return int(count_nonzero(previous_hash != current_hash))  # Hamming distance between the hashes
+
+
+def are_hashes_different(previous_hash: ndarray | None, current_hash: ndarray, cutoff: int = 1) -> bool:
+    return get_hash_difference(previous_hash, current_hash) >= cutoff
 
 
 class ImageCache:
@@ -172,176 +219,70 @@ class ImageCache:
 IMAGE_CACHE: ImageCache = ImageCache()
 
 
-class PixelSetCache:
-    def __init__(self, base_path: str, language: str, debug: bool = False):
-        self.base_path: str = base_path
-        self.lang_path: str = path.join(base_path, language)
-        self.debug: bool = debug
-        self.cache: dict[str, dict[str, dict[str, set[tuple[int, int]]]]] = {}
-        if not path.exists(self.lang_path):
-            return
-        self.init()
-
-    def init(self):
-        if self.debug:
-            print("Loading pixel sets to cache...")
-        self.cache.clear()
-        makedirs(self.lang_path, exist_ok=True)
-        for resolution in listdir(self.lang_path):
-            resolution_path = path.join(self.lang_path, resolution)
-            if not path.isdir(resolution_path):
-                continue
-            for detection_box_id in listdir(resolution_path):
-                detection_box_path = path.join(resolution_path, detection_box_id)
-                if not path.isdir(detection_box_path):
-                    continue
-                for filename in listdir(detection_box_path):
-                    pixelset_path = path.join(detection_box_path, filename)
-                    if not path.isfile(pixelset_path) or not filename.endswith(".pixelset"):
-                        continue
-                    identifier = path.splitext(filename)[0]
-                    if self.get_pixelset(resolution, detection_box_id, identifier) is None:
-                        pixelset = self.read_pixelset(pixelset_path)
-                        self.set_pixelset(resolution, detection_box_id, identifier, pixelset)
-                        if self.debug:
-                            print(f"Loaded pixel set: {resolution}/{detection_box_id}/{identifier}.pixelset")
-        if self.debug:
-            print("Finished loading pixel sets to cache.")
-
-    def change_language(self, language: str) -> None:
-        self.lang_path = path.join(self.base_path, language)
-        self.init()
-
-    def get_pixelset(self, resolution: str, detection_box_id: str, identifier: str) -> set[tuple[int, int]] | None:
-        if resolution in self.cache and detection_box_id in self.cache[resolution] and identifier in self.cache[resolution][detection_box_id]:
-            return self.cache[resolution][detection_box_id][identifier]
-        return None
-
-    def get_pixelsets(self, resolution: str, detection_box_id: str) -> dict[str, set[tuple[int, int]]]:
-        if resolution in self.cache and detection_box_id in self.cache[resolution]:
-            return self.cache[resolution][detection_box_id]
-        return {}
-
-    def set_pixelset(self, resolution: str, detection_box_id: str, identifier: str, pixelset: set[tuple[int, int]]) -> None:
-        if resolution not in self.cache:
-            self.cache[resolution] = {}
-        if detection_box_id not in self.cache[resolution]:
-            self.cache[resolution][detection_box_id] = {}
-        if not pixelset or len(pixelset) < 10:
-            return
-        self.cache[resolution][detection_box_id][identifier] = pixelset
-
-    def save_pixelset(self, resolution: str, detection_box_id: str, identifier: str, pixelset: set[tuple[int, int]]) -> None:
-        if resolution not in self.cache:
-            self.cache[resolution] = {}
-        if detection_box_id not in self.cache[resolution]:
-            self.cache[resolution][detection_box_id] = {}
-        self.cache[resolution][detection_box_id][identifier] = pixelset
-
-        # Write-through to disk
-        tgt_path = path.join(self.lang_path, resolution, detection_box_id)
-        makedirs(tgt_path, exist_ok=True)
-        pixelset_path = path.join(tgt_path, f"{identifier}.pixelset")
-        with open(pixelset_path, "w") as file:
-            for x, y in pixelset:
-                file.write(f"{x} {y}\n")
-
-    def read_pixelset(self, filepath: str) -> set[tuple[int, int]]:
-        if not path.exists(filepath):
-            return set()
-        with open(filepath, "r") as file:
-            lines = file.readlines()
-        pixelset: set[tuple[int, int]] = set()
-        for line in lines:
-            line = line.strip()
-            if line:
-                x, y = map(int, line.split())
-                pixelset.add((x, y))
-        return pixelset
-
-    def clear_cache(self) -> None:
-        self.cache = {}
-
-    def all_characters_learned(self, screen_width: int, screen_height: int) -> bool:
+class ButtonTemplates:
+    def __init__(self, coordinates: tuple[int, int, int, int], mask: ndarray):
+        self.coordinates: tuple[int, int, int, int] = coordinates
+        self.mask: ndarray = mask
+        self.references: list[tuple[str, str, ndarray]] = []  # (button_type, controller_type, hash of the masked reference)
+
+
+class ButtonTemplateBank:
+    # Button references resized, masked and hashed once per resolution, so that checking a frame only needs a crop and a hash per geometry.
+    def __init__(self, buttons_path: str):
+        self.buttons_path: str = buttons_path
+        self.lock: Lock = Lock()
+        self.banks: dict[str, dict[str, ButtonTemplates]] = {}
+
+    def get_templates(self, screen_width: int, screen_height: int) -> dict[str, ButtonTemplates]:
         resolution = f"{screen_width}x{screen_height}"
-        detection_box_id = MENU_DETECTION
-        pixelset_characters: list[str] = list(self.get_pixelsets(resolution, detection_box_id).keys())
-        return all(character in pixelset_characters for character in get_all_character_names())
-
-
-class PixelSet:
-    def __init__(
-        self,
-        cache: PixelSetCache,
-        cropped: ndarray,
-        screen_width: int,
-        screen_height: int,
-        detection_id: str,
-    ):
-        self.cache: PixelSetCache = cache
-        self.cropped: ndarray = cropped
-        self.resolution: str = f"{screen_width}x{screen_height}"
-        self.detection_id: str = detection_id
-        self.fn_rate: float = PIXELSET_FN_RATES[detection_id]
-        self.fp_rate: float = PIXELSET_FP_RATES[detection_id]
-        self.pixelset_threshold: int = PIXELSET_THRESHOLDS[detection_id]
-        threshold_reduction: int = PIXELSET_THRESHOLD_REDUCTIONS[detection_id]
-        self.pixelset: set = set()
-        _, self.image = threshold(cropped, self.pixelset_threshold - threshold_reduction, 255, THRESH_BINARY)
-        self.height, self.width = cropped.shape[:2]
-        for y in range(self.height):
-            for x in range(self.width):
-                if self.image[y, x] == 255:
-                    self.pixelset.add((x, y))
-
-    def size(self) -> int:
-        return len(self.pixelset)
-
-    def write(self, identifier: str) -> None:
-        _, ref_image = threshold(self.cropped, self.pixelset_threshold, 255, THRESH_BINARY)
-        ref_pixelset: set = set()
-        for y in range(self.height):
-            for x in range(self.width):
-                if ref_image[y, x] == 255:
-                    ref_pixelset.add((x, y))
-        if len(ref_pixelset) < 10:
-            return  # Require at least 10 pixels to write
-        self.cache.save_pixelset(self.resolution, self.detection_id, identifier, ref_pixelset)
-
-    def find_match(self, detection_id: str, exhaustive: bool = True) -> str:
-        if len(self.pixelset) < 10:
-            return ""
-        pixelsets: dict[str, set[tuple[int, int]]] = self.cache.get_pixelsets(self.resolution, self.detection_id)
-        best_match: str = ""
-        best_fn_rate: float = 1.0
-        for identifier in pixelsets.keys():
-            ref_pixelset: set = pixelsets[identifier]
-            fn_rate = len(ref_pixelset - self.pixelset) / len(ref_pixelset) if ref_pixelset else 0
-            fp_rate = len(self.pixelset - ref_pixelset) / len(self.pixelset) if self.pixelset else 0
-            if fn_rate <= self.fn_rate and fp_rate <= self.fp_rate:
-                if exhaustive:
-                    if best_match == "" or (fn_rate < best_fn_rate):
-                        if detection_id in ARMAMENT_DETECTION_IDS:
-                            try:
-                                match = find_grabbable_name_by_id(identifier)
-                            except:
-                                match = ""
-                        else:
-                            match = identifier
-                        best_match = match
-                        best_fn_rate = fn_rate
-                else:
-                    if detection_id in ARMAMENT_DETECTION_IDS:
-                        try:
-                            match = find_grabbable_name_by_id(identifier)
-                        except:
-                            match = ""
-                    else:
-                        match = identifier
-                    return match
-        if exhaustive:
-            return best_match
-        return ""  # No match found
+        with self.lock:
+            if resolution not in self.banks:
+                self.banks[resolution] = self.build_templates(screen_width, screen_height)
+            return self.banks[resolution]
+
+    def build_templates(self, screen_width: int, screen_height: int) -> dict[str, ButtonTemplates]:
+        bank: dict[str, ButtonTemplates] = {}
+        for geometry_type in BUTTON_GEOMETRY_TYPES:
+            top, bottom, left, right = get_button_coordinates(screen_width, screen_height, geometry_type)
+            dimensions = (right - left, bottom - top)
+            mask_path = path.join(self.buttons_path, f"{geometry_type}_mask.png")
+            mask_np = resize(array(IMAGE_CACHE.get_image(mask_path)), dimensions, interpolation=INTER_AREA)
+            templates = ButtonTemplates((top, bottom, left, right), mask_np)
+            for button_type in BUTTON_TYPES:
+                for controller_type in CONTROLLER_TYPES_BY_BUTTON_GEOMETRY[geometry_type]:
+                    ref_img_path = path.join(self.buttons_path, f"{button_type}_{controller_type}.png")
+                    ref_img_np = resize(array(IMAGE_CACHE.get_image(ref_img_path)), dimensions, interpolation=INTER_AREA)
+                    templates.references.append((button_type, controller_type, get_image_hash(bitwise_and(ref_img_np, mask_np))))
+            bank[geometry_type] = templates
+        return bank
+
+
+class DetectionStats:
+    def __init__(self):
+        self.lock: Lock = Lock()
+        self.counts: dict[str, dict[str, int]] = {}
+
+    def record(self, detection_id: str, outcome: str) -> None:
+        with self.lock:
+            if detection_id not in self.counts:
+                self.counts[detection_id] = {outcome: 0 for outcome in DETECTION_OUTCOMES}
+            self.counts[detection_id][outcome] += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.counts = {}
+
+    def summary(self) -> str:
+        lines: list[str] = []
+        with self.lock:
+            for detection_id, counts in self.counts.items():
+                total = sum(counts.values())
+                outcomes_text = ", ".join(f"{outcome} {count} ({count / total:.1%})" for outcome, count in counts.items())
+                lines.append(f"{detection_id}: {total} detections - {outcomes_text}")
+        return "\n".join(lines)
+
+
+DETECTION_STATS: DetectionStats = DetectionStats()
 
 
 def version_is_older(version: str, target_version: str) -> bool:
@@ -405,6 +346,29 @@ def get_detection_box_coordinates(identifier: str, screen_width: int, screen_hei
     return top, bottom, left, right
 
 
+def get_capture_regions(detection_ids: Iterable[str], screen_width: int, screen_height: int) -> list[tuple[int, int, int, int]]:
+    # Regions (left, top, right, bottom) covering the given detection boxes and every button, nearby ones being grouped together
+    boxes: list[tuple[int, int, int, int]] = [get_detection_box_coordinates(detection_id, screen_width, screen_height) for detection_id in detection_ids]
+    boxes.extend(get_button_coordinates(screen_width, screen_height, geometry_type) for geometry_type in BUTTON_GEOMETRY_TYPES)
+    regions: list[list[int]] = [[max(0, left), max(0, top), min(screen_width, right), min(screen_height, bottom)] for top, bottom, left, right in boxes]
+    regions = [region for region in regions if region[0] < region[2] and region[1] < region[3]]
+    distance: int = round(screen_height * CAPTURE_REGION_MERGE_DISTANCE)
+    merged: bool = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] - distance <= b[2] and b[0] - distance <= a[2] and a[1] - distance <= b[3] and b[1] - distance <= a[3]:
+                    regions[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [(left, top, right, bottom) for left, top, right, bottom in regions]
+
+
 def get_detection_box_coordinates_rel(identifier: str, screen_width: int, screen_height: int) -> tuple[float, float, float, float]:
     top, bottom, left, right = get_detection_box_coordinates(identifier, screen_width, screen_height)
     return top / screen_height, bottom / screen_height, left / screen_width, right / screen_width
@@ -0,0 +1,270 @@
+from abc import ABC, abstractmethod
+from numpy import ndarray, ascontiguousarray, nonzero
+from cv2 import resize, threshold, copyMakeBorder, INTER_AREA, INTER_CUBIC, THRESH_BINARY, BORDER_CONSTANT
+from PIL import Image
+from threading import Lock, RLock, local
+from concurrent.futures import ThreadPoolExecutor, Future
+from hashlib import blake2b
+from collections import OrderedDict
+from os import path, makedirs, listdir, replace
+import json
+from pytesseract import pytesseract
+from lib.constants import *
+
+try:
+    import tesserocr  # Optional, runs Tesseract in-process
+except ImportError:
+    tesserocr = None
+
+OCR_BACKENDS = [
+    OCR_BACKEND_PYTESSERACT := "pytesseract",
+    OCR_BACKEND_TESSEROCR := "tesserocr",
+]
+
+
+def parse_tesseract_config(config: str) -> tuple[int | None, int | None, dict[str, str]]:
+    # Splits a Tesseract command line configuration into its page segmentation mode, engine mode and variables
+    psm: int | None = None
+    oem: int | None = None
+    variables: dict[str, str] = {}
+    arguments: list[str] = config.split()
+    i = 0
+    while i < len(arguments):
+        argument = arguments[i]
+        value = arguments[i + 1] if i + 1 < len(arguments) else ""
+        if argument == "--psm":
+            psm = int(value)
+        elif argument == "--oem":
+            oem = int(value)
+        elif argument == "-c" and "=" in value:
+            name, variable_value = value.split("=", 1)
+            variables[name] = variable_value
+        else:
+            i += 1
+            continue
+        i += 2
+    return psm, oem, variables
+
+
+class OcrBackend(ABC):
+    # Reads the text of a (thresholded) image, in the given Tesseract language (ex: "eng")
+    @abstractmethod
+    def recognize(self, img: ndarray, language: str) -> str:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class PytesseractBackend(OcrBackend):
+    # Runs the tesseract executable for every image, which loads the language model every time
+    def __init__(self, config: str, timeout: float):
+        self.config: str = config
+        self.timeout: float = timeout
+
+    def recognize(self, img: ndarray, language: str) -> str:
+        return pytesseract.image_to_string(img, config=self.config, lang=language, timeout=self.timeout)
+
+
+class TesserocrBackend(OcrBackend):
+    # Keeps Tesseract engines loaded across calls. An engine can only be used by one thread at a time, so each thread gets its own,
+    # which keeps its language model loaded until that thread asks for another language. There is no timeout on in-process reads.
+    def __init__(self, tessdata_path: str, config: str):
+        if tesserocr is None:
+            raise ImportError("tesserocr is not installed")
+        self.tessdata_path: str = tessdata_path
+        self.psm, self.oem, self.variables = parse_tesseract_config(config)
+        self.local = local()
+        self.lock: Lock = Lock()
+        self.apis: list = []
+
+    def get_api(self, language: str):
+        api = getattr(self.local, "api", None)
+        if api is not None and self.local.language == language:
+            return api
+        if api is None:
+            api = tesserocr.PyTessBaseAPI(init=False)
+            with self.lock:
+                self.apis.append(api)
+        else:
+            self.local.language = None  # Until the new language is loaded
+            api.End()
+        oem = tesserocr.OEM(self.oem) if self.oem is not None else tesserocr.OEM.DEFAULT
+        api.InitFull(path=self.tessdata_path, lang=language, oem=oem, variables=self.variables)
+        if self.psm is not None:
+            api.SetPageSegMode(tesserocr.PSM(self.psm))
+        self.local.api = api
+        self.local.language = language
+        return api
+
+    def recognize(self, img: ndarray, language: str) -> str:
+        api = self.get_api(language)
+        api.SetImage(Image.fromarray(img))
+        return api.GetUTF8Text()
+
+    def close(self) -> None:
+        with self.lock:
+            for api in self.apis:
+                api.End()
+            self.apis.clear()
+
+
+def create_ocr_backend(backend: str, tessdata_path: str, config: str, timeout: float) -> OcrBackend:
+    # The in-process engine has no timeout, a read that hangs keeps its thread forever, so it is only used when asked for
+    if backend == OCR_BACKEND_TESSEROCR:
+        return TesserocrBackend(tessdata_path, config)
+    return PytesseractBackend(config, timeout)
+
+
+def prepare_ocr_image(img: ndarray) -> ndarray:
+    # Trims a thresholded image (dark text on white) to its text, rescales it so that the text line is OCR_TEXT_HEIGHT pixels tall,
+    # and adds a white margin around it. The detection boxes are much wider than their text, and their text is small at low resolutions.
+    rows = nonzero((img < 128).any(axis=1))[0]
+    if rows.size == 0:
+        return img  # No text, nothing to trim
+    columns = nonzero((img < 128).any(axis=0))[0]
+    text = img[rows[0] : rows[-1] + 1, columns[0] : columns[-1] + 1]
+    scale = min(max(OCR_TEXT_HEIGHT / text.shape[0], OCR_MIN_SCALE), OCR_MAX_SCALE)
+    if scale != 1:
+        width = max(1, round(text.shape[1] * scale))
+        height = max(1, round(text.shape[0] * scale))
+        text = resize(text, (width, height), interpolation=INTER_AREA if scale < 1 else INTER_CUBIC)
+        _, text = threshold(text, 127, 255, THRESH_BINARY)  # Back to black and white
+    return copyMakeBorder(text, OCR_TEXT_MARGIN, OCR_TEXT_MARGIN, OCR_TEXT_MARGIN, OCR_TEXT_MARGIN, BORDER_CONSTANT, value=255)
+
+
+def get_ocr_digest(img: ndarray, language: str) -> bytes:
+    # Identifies an OCR read: same image (pixels and shape) in the same language, same text
+    digest = blake2b(digest_size=16)
+    digest.update(language.encode("utf-8"))
+    digest.update(repr(img.shape).encode("ascii"))
+    digest.update(ascontiguousarray(img).tobytes())
+    return digest.digest()
+
+
+# Extension of the files the OCR results are persisted in, one file per language and resolution
+OCR_RESULT_CACHE_FILE_EXTENSION = ".json"
+
+
+class OcrResultCache:
+    # Bounded LRU of the text read for every (thresholded) image, by digest. Catches the repeated images the pixel sets do not,
+    # such as the ones whose text is not a perfect match, which are never learned. Entries keep the language and resolution
+    # they were read in, which decide the file they are persisted in.
+    def __init__(self, max_size: int):
+        self.lock: Lock = Lock()
+        self.max_size: int = max_size
+        self.entries: OrderedDict[bytes, tuple[str, str, str]] = OrderedDict()
+
+    def get(self, digest: bytes) -> str | None:
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                return None
+            self.entries.move_to_end(digest)
+            return entry[0]
+
+    def put(self, digest: bytes, text: str, language: str, resolution: str) -> None:
+        with self.lock:
+            self.entries[digest] = (text, language, resolution)
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def load(self, base_path: str, language: str) -> int:
+        # Adds the persisted results of every resolution of the language, returns how many were read
+        language_path = path.join(base_path, language)
+        if not path.isdir(language_path):
+            return 0
+        loaded = 0
+        for filename in listdir(language_path):
+            if not filename.endswith(OCR_RESULT_CACHE_FILE_EXTENSION):
+                continue
+            resolution = filename[: -len(OCR_RESULT_CACHE_FILE_EXTENSION)]
+            try:
+                with open(path.join(language_path, filename), "r", encoding="utf-8") as file:
+                    results: dict[str, str] = json.load(file)
+            except (OSError, ValueError):
+                continue  # Unreadable results are read again by the OCR
+            for digest, text in results.items():
+                try:
+                    self.put(bytes.fromhex(digest), text, language, resolution)
+                except (ValueError, TypeError):
+                    continue
+                loaded += 1
+        return loaded
+
+    def save(self, base_path: str) -> None:
+        # Results are written to a temporary file that then replaces the previous one, so a crash cannot leave a partial file
+        with self.lock:
+            partitions: dict[tuple[str, str], dict[str, str]] = {}
+            for digest, (text, language, resolution) in self.entries.items():
+                partitions.setdefault((language, resolution), {})[digest.hex()] = text
+        for (language, resolution), results in partitions.items():
+            makedirs(path.join(base_path, language), exist_ok=True)
+            filepath = path.join(base_path, language, resolution + OCR_RESULT_CACHE_FILE_EXTENSION)
+            with open(filepath + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(results, file, ensure_ascii=False)
+            replace(filepath + ".tmp", filepath)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+class OcrJob:
+    def __init__(self, digest: bytes, future: Future):
+        self.digest: bytes = digest
+        self.future: Future = future
+        self.waiters: int = 1  # Detectors that still want the result
+
+
+class OcrPool:
+    # Runs the OCR reads on a few worker threads, so that a slow read does not block the detector that asked for it.
+    # Identical reads (same digest) that are requested while one is in flight share the same job.
+    # Every read that completes goes into the result cache, even if the detectors that asked for it stopped waiting.
+    def __init__(self, backend: OcrBackend, workers: int, result_cache: OcrResultCache | None = None):
+        self.backend: OcrBackend = backend
+        self.result_cache: OcrResultCache | None = result_cache
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr")
+        self.lock: RLock = RLock()  # Reentrant, as cancelling a job runs its done callback in the same thread
+        self.jobs: dict[bytes, OcrJob] = {}
+
+    def submit(self, img: ndarray, language: str, digest: bytes | None = None, cache_partition: tuple[str, str] | None = None) -> OcrJob:
+        # cache_partition is the (language, resolution) the result is cached under, it is not cached without one
+        digest = digest or get_ocr_digest(img, language)
+        with self.lock:
+            job = self.jobs.get(digest)
+            if job is not None and not job.future.cancelled():
+                job.waiters += 1
+                return job
+            job = OcrJob(digest, self.executor.submit(self.recognize, img, language))
+            self.jobs[digest] = job
+            job.future.add_done_callback(lambda _: self.finish(job, cache_partition))
+        return job
+
+    def recognize(self, img: ndarray, language: str) -> str:
+        # The image is prepared by the worker, the digest (and the OCR result cache) is that of the image as it was cropped
+        return self.backend.recognize(prepare_ocr_image(img), language)
+
+    def finish(self, job: OcrJob, cache_partition: tuple[str, str] | None) -> None:
+        self.forget(job)
+        if self.result_cache is None or cache_partition is None or job.future.cancelled() or job.future.exception() is not None:
+            return
+        self.result_cache.put(job.digest, job.future.result(), *cache_partition)
+
+    def forget(self, job: OcrJob) -> None:
+        with self.lock:
+            if self.jobs.get(job.digest) is job:
+                del self.jobs[job.digest]
+
+    def abandon(self, job: OcrJob) -> None:
+        # The job is only cancelled if nobody else is waiting for it, and it has not started yet. This is done with the lock held,
+        # so that a detector cannot join the job between the check and the cancellation.
+        with self.lock:
+            job.waiters -= 1
+            if job.waiters == 0 and job.future.cancel():
+                self.forget(job)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.backend.close()
@@ -0,0 +1,727 @@
+from numpy import ndarray, array, zeros, zeros_like, frombuffer, packbits, unpackbits, nonzero, vstack, where, argmin, argsort, lexsort, searchsorted, minimum, maximum, linspace, unique, add, prod, inf, uint8, int64
+from cv2 import threshold, resize, THRESH_BINARY, INTER_AREA, INTER_LINEAR
+from os import path, makedirs, listdir, replace, fsync
+from shutil import rmtree
+from threading import Thread, Lock, Condition, Event
+from typing import Callable
+from struct import pack, unpack_from, calcsize
+from mmap import mmap, ACCESS_READ
+from zipfile import ZipFile, BadZipFile, ZIP_DEFLATED
+from zlib import error as ZlibError
+import json
+from lib.characters import get_all_character_names
+from lib.constants import *
+from lib.armaments import *
+from lib.misc import get_detection_box_coordinates
+
+# Pixel sets are kept as bitmaps of the detection box (row-major), packed 8 pixels per byte.
+# On disk, every (language, resolution, detection box) has a single file holding all of its bitmaps:
+#   header: magic, format version, bitmap height, bitmap width, reserved, number of bitmaps, size of the id table
+#   id table: JSON list of the identifiers (UTF-8), padded to a multiple of 8 bytes
+#   bitmaps: one packed bitmap per identifier, in the same order as the id table
+PIXELSET_FILE_EXTENSION = ".pixelsets"
+PIXELSET_FILE_MAGIC = b"NRPS"
+PIXELSET_FILE_VERSION = 1
+PIXELSET_FILE_HEADER = "<4sHHHHII"
+PIXELSET_FILE_HEADER_SIZE = calcsize(PIXELSET_FILE_HEADER)
+# Pixel set packs are zip files holding a manifest and the pixel set files of one language and resolution
+PIXELSET_PACK_MANIFEST = "manifest.json"
+PIXELSET_PACK_FORMAT = 1
+LEGACY_PIXELSET_FILE_EXTENSION = ".pixelset"
+
+POPCOUNT_TABLE: ndarray = array([bin(byte).count("1") for byte in range(256)], dtype=uint8)
+
+
+def popcount(bits: ndarray) -> int:
+    return int(POPCOUNT_TABLE[bits].sum(dtype=int64))
+
+
+def pack_bitmap(bitmap: ndarray) -> ndarray:
+    return packbits(bitmap.ravel() != 0)
+
+
+def unpack_bitmap(bits: ndarray, shape: tuple[int, int]) -> ndarray:
+    return unpackbits(bits, count=shape[0] * shape[1]).reshape(shape).astype(bool)
+
+
+def get_signature_band_starts(width: int) -> ndarray:
+    return unique(linspace(0, width, PIXELSET_SIGNATURE_BANDS + 1)[:-1].astype(int64))
+
+
+def get_pixelset_signature(bitmap: ndarray) -> ndarray:
+    # Number of lit pixels in each vertical band of the bitmap
+    return add.reduceat(bitmap.astype(bool).sum(axis=0, dtype=int64), get_signature_band_starts(bitmap.shape[1]))
+
+
+def shift_bitmap(bitmap: ndarray, dy: int, dx: int) -> ndarray:
+    # Moves the bitmap by (dy, dx) pixels, the pixels that are shifted out are lost and the uncovered ones are left empty
+    height, width = bitmap.shape
+    shifted: ndarray = zeros_like(bitmap)
+    shifted[max(0, dy) : height + min(0, dy), max(0, dx) : width + min(0, dx)] = bitmap[max(0, -dy) : height + min(0, -dy), max(0, -dx) : width + min(0, -dx)]
+    return shifted
+
+
+def get_pixelset_shape(resolution: str, detection_box_id: str) -> tuple[int, int]:
+    screen_width, screen_height = map(int, resolution.split("x"))
+    top, bottom, left, right = get_detection_box_coordinates(detection_box_id, screen_width, screen_height)
+    return bottom - top, right - left
+
+
+def get_canonical_pixelset_shape(detection_box_id: str) -> tuple[int, int]:
+    return get_pixelset_shape(PIXELSET_CANONICAL_RESOLUTION, detection_box_id)
+
+
+def rescale_crop(cropped: ndarray, shape: tuple[int, int]) -> ndarray:
+    # Brings a grayscale crop of the detection box to the given (height, width) shape
+    if cropped.shape[:2] == shape:
+        return cropped
+    shrinking = cropped.shape[0] * cropped.shape[1] > shape[0] * shape[1]
+    return resize(cropped, (shape[1], shape[0]), interpolation=INTER_AREA if shrinking else INTER_LINEAR)
+
+
+def rescale_pixelset(pixelset: ndarray, source_shape: tuple[int, int], target_shape: tuple[int, int]) -> ndarray:
+    if source_shape == target_shape:
+        return pixelset
+    bitmap: ndarray = unpack_bitmap(pixelset, source_shape).astype(uint8) * 255
+    return pack_bitmap(rescale_crop(bitmap, target_shape) >= 128)
+
+
+def get_row_size(shape: tuple[int, int]) -> int:
+    return (shape[0] * shape[1] + 7) // 8
+
+
+def is_resolution(name: str) -> bool:
+    # Check that name has format <number>x<number>, with both numbers above zero
+    return len(name.split("x")) == 2 and all(part.isdecimal() and int(part) > 0 for part in name.split("x"))
+
+
+def read_pixelsets(buffer: bytes | mmap, shape: tuple[int, int]) -> dict[str, ndarray]:
+    # Parses the contents of a pixel set file, the returned pixel sets are views of the buffer
+    if len(buffer) < PIXELSET_FILE_HEADER_SIZE:
+        return {}
+    magic, version, height, width, _, count, ids_size = unpack_from(PIXELSET_FILE_HEADER, buffer, 0)
+    if magic != PIXELSET_FILE_MAGIC or version != PIXELSET_FILE_VERSION or (height, width) != shape:
+        # Unknown format, or bitmaps for a detection box that has since changed dimensions
+        return {}
+    identifiers: list[str] = json.loads(bytes(buffer[PIXELSET_FILE_HEADER_SIZE : PIXELSET_FILE_HEADER_SIZE + ids_size]).decode("utf-8"))
+    offset = PIXELSET_FILE_HEADER_SIZE + ((ids_size + 7) // 8) * 8
+    row_size = get_row_size(shape)
+    if count == 0 or len(identifiers) != count or offset + count * row_size > len(buffer):
+        return {}
+    matrix = frombuffer(buffer, dtype=uint8, count=count * row_size, offset=offset).reshape(count, row_size)
+    return {identifier: matrix[i] for i, identifier in enumerate(identifiers)}
+
+
+class PixelSetGroup:
+    # All the reference pixel sets of one resolution and detection box, stacked as a single bit matrix
+    # (one row per reference), so that a pixel set can be compared against every reference at once.
+    # Rows are sorted by pixel count, and each row keeps a coarse signature (lit pixels per vertical band),
+    # so that most references can be safely rejected before the exact comparison.
+    def __init__(self, shape: tuple[int, int], filepath: str = ""):
+        self.shape: tuple[int, int] = shape
+        self.filepath: str = filepath
+        self.lock: Lock = Lock()
+        self.save_lock: Lock = Lock()
+        self.pixelsets: dict[str, ndarray] = {}
+        self.signatures: dict[str, ndarray] = {}
+        self.index: tuple[list[str], ndarray, ndarray, ndarray, ndarray] | None = None
+        self.mapping: mmap | None = None  # While set, the loaded pixel sets are views of the memory-mapped file
+
+    @staticmethod
+    def load(filepath: str, shape: tuple[int, int]) -> "PixelSetGroup":
+        group = PixelSetGroup(shape, filepath)
+        if not path.isfile(filepath) or path.getsize(filepath) < PIXELSET_FILE_HEADER_SIZE:
+            return group
+        with open(filepath, "rb") as file:
+            mapping = mmap(file.fileno(), 0, access=ACCESS_READ)
+        pixelsets = read_pixelsets(mapping, shape)
+        if len(pixelsets) == 0:
+            mapping.close()
+            return group
+        group.pixelsets = pixelsets
+        group.mapping = mapping
+        return group
+
+    def release_mapping(self) -> None:
+        # Must be called with the lock held. Copies the pixel sets out of the mapped file, so that the file can be replaced.
+        if self.mapping is None:
+            return
+        self.pixelsets = {identifier: pixelset.copy() for identifier, pixelset in self.pixelsets.items()}
+        try:
+            self.mapping.close()
+        except BufferError:
+            pass  # Still referenced somewhere else, it will be closed once collected
+        self.mapping = None
+
+    def save(self) -> None:
+        # Only the snapshot is taken with the lock held, so that matching is never blocked by the disk.
+        with self.save_lock:
+            with self.lock:
+                self.release_mapping()
+                row_size = get_row_size(self.shape)
+                identifiers = [identifier for identifier, pixelset in self.pixelsets.items() if pixelset.size == row_size]
+                bitmaps_data = b"".join(self.pixelsets[identifier].tobytes() for identifier in identifiers)
+            ids_data = json.dumps(identifiers, ensure_ascii=False).encode("utf-8")
+            header = pack(PIXELSET_FILE_HEADER, PIXELSET_FILE_MAGIC, PIXELSET_FILE_VERSION, self.shape[0], self.shape[1], 0, len(identifiers), len(ids_data))
+            ids_data += b"\0" * (((len(ids_data) + 7) // 8) * 8 - len(ids_data))
+            makedirs(path.dirname(self.filepath), exist_ok=True)
+            # Write to a temporary file first, so that the pixel set file is never left half written
+            tmp_filepath = self.filepath + ".tmp"
+            with open(tmp_filepath, "wb") as file:
+                file.write(header)
+                file.write(ids_data)
+                file.write(bitmaps_data)
+                file.flush()
+                fsync(file.fileno())
+            replace(tmp_filepath, self.filepath)
+
+    def set(self, identifier: str, pixelset: ndarray) -> None:
+        with self.lock:
+            self.pixelsets[identifier] = pixelset
+            self.signatures.pop(identifier, None)
+            self.index = None  # Rebuilt on the next match
+
+    def get_index(self) -> tuple[list[str], ndarray, ndarray, ndarray, ndarray] | None:
+        # (identifiers, matrix, counts, signatures, insertion ranks), all sorted by pixel count
+        with self.lock:
+            if self.index is None and len(self.pixelsets) > 0:
+                row_size = get_row_size(self.shape)
+                identifiers = [identifier for identifier, pixelset in self.pixelsets.items() if pixelset.size == row_size]
+                if len(identifiers) == 0:
+                    return None
+                for identifier in identifiers:
+                    if identifier not in self.signatures:
+                        self.signatures[identifier] = get_pixelset_signature(unpack_bitmap(self.pixelsets[identifier], self.shape))
+                matrix = vstack([self.pixelsets[identifier] for identifier in identifiers])
+                counts = POPCOUNT_TABLE[matrix].sum(axis=1, dtype=int64)
+                order = argsort(counts, kind="stable")
+                self.index = (
+                    [identifiers[i] for i in order],
+                    matrix[order],
+                    counts[order],
+                    vstack([self.signatures[identifiers[i]] for i in order]),
+                    order,
+                )
+            return self.index
+
+    def find_match(self, pixelsets: ndarray, pixel_counts: ndarray, signatures: ndarray, fn_rate: float, fp_rate: float, exhaustive: bool = True) -> str | None:
+        # Compares every variant (one per row, e.g. the current pixel set shifted by a few pixels) against every reference,
+        # and returns the identifier of the best matching reference (lowest false negative rate over its variants), or None
+        index = self.get_index()
+        if index is None or index[1].shape[1] != pixelsets.shape[1]:
+            return None
+        variants = nonzero(pixel_counts > 0)[0]
+        if variants.size == 0:
+            return None
+        pixelsets, pixel_counts, current_signatures = pixelsets[variants], pixel_counts[variants], signatures[variants]
+        identifiers, matrix, counts, signatures, ranks = index
+        # With I being the number of shared pixels, R the reference's pixel count and C the current one, a match requires
+        # I >= (1 - fn_rate) * R and I >= (1 - fp_rate) * C. Since I <= min(R, C), R must be within [(1 - fp_rate) * C, C / (1 - fn_rate)].
+        lo = int(searchsorted(counts, (1 - fp_rate) * pixel_counts.min() - 1e-9, side="left"))
+        hi = int(searchsorted(counts, pixel_counts.max() / (1 - fn_rate) + 1e-9, side="right")) if fn_rate < 1 else len(identifiers)
+        if lo >= hi:
+            return None
+        # The sum of the per band minimums is an upper bound of I, so references below the required I can be rejected. (variants x references)
+        required = maximum((1 - fn_rate) * counts[lo:hi], (1 - fp_rate) * pixel_counts[:, None])
+        bounds = minimum(signatures[lo:hi][None, :, :], current_signatures[:, None, :]).sum(axis=2)
+        candidates = lo + nonzero((bounds >= required - 1e-9).any(axis=0))[0]
+        if candidates.size == 0:
+            return None
+        intersections: ndarray = POPCOUNT_TABLE[matrix[candidates][:, None, :] & pixelsets[None, :, :]].sum(axis=2, dtype=int64)
+        candidate_counts = counts[candidates][:, None]
+        fn_rates: ndarray = where(candidate_counts > 0, (candidate_counts - intersections) / candidate_counts.clip(min=1), 0.0)
+        fp_rates: ndarray = (pixel_counts[None, :] - intersections) / pixel_counts[None, :]
+        valid: ndarray = (fn_rates <= fn_rate) & (fp_rates <= fp_rate)
+        if not valid.any():
+            return None
+        # Each reference keeps its best variant
+        fn_rates = where(valid, fn_rates, inf).min(axis=1)
+        candidates, fn_rates = candidates[valid.any(axis=1)], fn_rates[valid.any(axis=1)]
+        # Ties are resolved in favor of the reference that was added first
+        if exhaustive:
+            return identifiers[int(candidates[lexsort((ranks[candidates], fn_rates))[0]])]
+        return identifiers[int(candidates[argmin(ranks[candidates])])]
+
+
+class PixelSetWriter(Thread):
+    # Persists learned pixel sets in the background. Saves of the same detection box that pile up while waiting are coalesced into one write.
+    def __init__(self, on_error: Callable[[Exception], None] | None = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stop_event = Event()
+        self.condition: Condition = Condition()
+        self.pending: dict[str, PixelSetGroup] = {}
+        self.writing: bool = False
+        self.on_error: Callable[[Exception], None] | None = on_error
+
+    def schedule(self, group: PixelSetGroup) -> None:
+        with self.condition:
+            self.pending[group.filepath] = group
+            self.condition.notify_all()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.pending) > 0 or self.is_stopped())
+                if len(self.pending) == 0:
+                    return  # Stopped, with nothing left to write
+            # Give other saves a chance to be batched with this one
+            self._stop_event.wait(PIXELSET_WRITE_DELAY)
+            with self.condition:
+                groups = list(self.pending.values())
+                self.pending.clear()
+                self.writing = True
+            for group in groups:
+                try:
+                    group.save()
+                except Exception as e:
+                    if self.on_error is not None:
+                        self.on_error(e)
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        # Waits until every scheduled save has been written, returns False on timeout
+        with self.condition:
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: len(self.pending) == 0 and not self.writing, timeout)
+
+    def stop(self) -> None:
+        # Pending saves are still written before the thread exits
+        self._stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+
+    def is_stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+
+def parse_pixelset_identifier(detection_box_id: str, identifier: str | int) -> str | int:
+    # Armament pixel sets are identified by the (integer) id of the grabbable, which legacy file names hold as text
+    if detection_box_id in ARMAMENT_DETECTION_IDS and isinstance(identifier, str) and identifier.lstrip("-").isdigit():
+        return int(identifier)
+    return identifier
+
+
+def read_legacy_pixelset(filepath: str, shape: tuple[int, int]) -> ndarray:
+    # Legacy format: one text file per identifier, with an "x y" line per pixel
+    bitmap: ndarray = zeros(shape, dtype=bool)
+    if not path.exists(filepath):
+        return pack_bitmap(bitmap)
+    with open(filepath, "r") as file:
+        coordinates = array(file.read().split(), dtype=int64).reshape(-1, 2)
+    xs, ys = coordinates[:, 0], coordinates[:, 1]
+    inside = (xs < shape[1]) & (ys < shape[0])
+    bitmap[ys[inside], xs[inside]] = True
+    return pack_bitmap(bitmap)
+
+
+def migrate_legacy_pixelsets(base_path: str) -> None:
+    # Converts every <language>/<resolution>/<detection box>/<identifier>.pixelset tree into a single pixel set file per detection box
+    if not path.isdir(base_path):
+        return
+    for language in listdir(base_path):
+        lang_path = path.join(base_path, language)
+        if not path.isdir(lang_path):
+            continue
+        for resolution in listdir(lang_path):
+            resolution_path = path.join(lang_path, resolution)
+            if not path.isdir(resolution_path) or not is_resolution(resolution):
+                continue
+            for detection_box_id in listdir(resolution_path):
+                detection_box_path = path.join(resolution_path, detection_box_id)
+                if not path.isdir(detection_box_path) or detection_box_id not in DETECTION_BOXES:
+                    continue
+                shape = get_pixelset_shape(resolution, detection_box_id)
+                group = PixelSetGroup.load(path.join(resolution_path, detection_box_id + PIXELSET_FILE_EXTENSION), shape)
+                for filename in listdir(detection_box_path):
+                    pixelset_path = path.join(detection_box_path, filename)
+                    if not path.isfile(pixelset_path) or not filename.endswith(LEGACY_PIXELSET_FILE_EXTENSION):
+                        continue
+                    identifier = parse_pixelset_identifier(detection_box_id, path.splitext(filename)[0])
+                    pixelset = read_legacy_pixelset(pixelset_path, shape)
+                    if identifier not in group.pixelsets and popcount(pixelset) >= 10:
+                        group.set(identifier, pixelset)
+                group.save()
+                rmtree(detection_box_path, ignore_errors=True)
+
+
+def migrate_pixelsets_to_canonical(base_path: str) -> None:
+    # Rescales the pixel sets learned at every resolution to the canonical one, and merges them into its pixel set files
+    if not path.isdir(base_path):
+        return
+    for language in listdir(base_path):
+        lang_path = path.join(base_path, language)
+        if not path.isdir(lang_path):
+            continue
+        resolutions = [resolution for resolution in listdir(lang_path) if is_resolution(resolution) and resolution != PIXELSET_CANONICAL_RESOLUTION]
+        # When the same identifier was learned at several resolutions, keep the one with the most detail
+        resolutions.sort(key=lambda resolution: -prod([int(part) for part in resolution.split("x")]))
+        groups: dict[str, PixelSetGroup] = {}
+        for resolution in resolutions:
+            resolution_path = path.join(lang_path, resolution)
+            if not path.isdir(resolution_path):
+                continue
+            for filename in listdir(resolution_path):
+                detection_box_id, extension = path.splitext(filename)
+                if extension != PIXELSET_FILE_EXTENSION or detection_box_id not in DETECTION_BOXES:
+                    continue
+                if detection_box_id not in groups:
+                    canonical_path = path.join(lang_path, PIXELSET_CANONICAL_RESOLUTION, detection_box_id + PIXELSET_FILE_EXTENSION)
+                    groups[detection_box_id] = PixelSetGroup.load(canonical_path, get_canonical_pixelset_shape(detection_box_id))
+                canonical_group = groups[detection_box_id]
+                source_shape = get_pixelset_shape(resolution, detection_box_id)
+                group = PixelSetGroup.load(path.join(resolution_path, filename), source_shape)
+                for identifier, pixelset in group.pixelsets.items():
+                    if identifier in canonical_group.pixelsets:
+                        continue
+                    pixelset = rescale_pixelset(pixelset, source_shape, canonical_group.shape)
+                    if popcount(pixelset) >= 10:
+                        canonical_group.set(identifier, pixelset)
+                group.release_mapping()
+        for group in groups.values():
+            group.save()
+        for resolution in resolutions:
+            rmtree(path.join(lang_path, resolution), ignore_errors=True)
+
+
+def resolve_pixelset_identifier(detection_box_id: str, identifier: str | int, language: str) -> str:
+    # Name that a pixel set identifier stands for in the given language (as the detectors would report it), or "" if unknown.
+    # Requires the character and grabbable specs of that language to be loaded.
+    if detection_box_id in ARMAMENT_DETECTION_IDS:
+        return find_grabbable_name_by_id(parse_pixelset_identifier(detection_box_id, identifier))
+    if detection_box_id == CHARACTER_DETECTION:
+        return identifier if identifier in get_all_character_names() else ""
+    if detection_box_id == MENU_DETECTION:
+        return identifier if identifier in (DORMANT_POWER_LANGUAGES[language], SHOP_LANGUAGES[language]) else ""
+    return ""
+
+
+def compact_pixelset_group(group: PixelSetGroup, detection_box_id: str, language: str) -> dict[str, int]:
+    # Removes the references that can never be useful, in three passes:
+    # - invalid: wrong size, less than 10 pixels, or an identifier that is not known anymore
+    # - duplicates: references that match an earlier reference of the same name within the detection box's rates
+    # - unreachable: references that, matched against the whole library, do not come back as their own name
+    fn_rate, fp_rate = PIXELSET_FN_RATES[detection_box_id], PIXELSET_FP_RATES[detection_box_id]
+    row_size = get_row_size(group.shape)
+    stats = {"before": len(group.pixelsets), "invalid": 0, "duplicates": 0, "unreachable": 0}
+    with group.lock:
+        group.release_mapping()
+        pixelsets: dict[str | int, ndarray] = dict(group.pixelsets)
+    names: dict[str | int, str] = {}
+    for identifier, pixelset in list(pixelsets.items()):
+        name = resolve_pixelset_identifier(detection_box_id, identifier, language)
+        if pixelset.size != row_size or popcount(pixelset) < 10 or name == "":
+            del pixelsets[identifier]
+            stats["invalid"] += 1
+        else:
+            names[identifier] = name
+    kept: dict[str, list[tuple[ndarray, int]]] = {}  # Name -> (pixel set, pixel count) of the references kept so far
+    for identifier, pixelset in list(pixelsets.items()):
+        pixel_count = popcount(pixelset)
+        duplicate = False
+        for reference, reference_count in kept.get(names[identifier], []):
+            intersection = popcount(reference & pixelset)
+            if reference_count - intersection <= fn_rate * reference_count and pixel_count - intersection <= fp_rate * pixel_count:
+                duplicate = True
+                break
+        if duplicate:
+            del pixelsets[identifier]
+            stats["duplicates"] += 1
+        else:
+            kept.setdefault(names[identifier], []).append((pixelset, pixel_count))
+    library = PixelSetGroup(group.shape)
+    for identifier, pixelset in pixelsets.items():
+        library.set(identifier, pixelset)
+    for identifier, pixelset in list(pixelsets.items()):
+        bitmap = unpack_bitmap(pixelset, group.shape)
+        match = library.find_match(pixelset[None, :], array([popcount(pixelset)]), get_pixelset_signature(bitmap)[None, :], fn_rate, fp_rate)
+        if match is None or names[match] != names[identifier]:
+            del pixelsets[identifier]
+            stats["unreachable"] += 1
+    # Armament ids migrated as strings are stored as the integers the learner uses, unless a reference of that integer id was kept too
+    compacted: dict[str | int, ndarray] = {}
+    for identifier, pixelset in pixelsets.items():
+        parsed_identifier = parse_pixelset_identifier(detection_box_id, identifier)
+        compacted[parsed_identifier if parsed_identifier not in pixelsets else identifier] = pixelset
+    pixelsets = compacted
+    with group.lock:
+        group.pixelsets = pixelsets
+        group.signatures = {identifier: signature for identifier, signature in group.signatures.items() if identifier in pixelsets}
+        group.index = None
+    stats["after"] = len(pixelsets)
+    return stats
+
+
+def compact_pixelsets(base_path: str, language: str) -> dict[str, dict[str, int]]:
+    # Compacts every pixel set file of a language, returns the statistics of each one (keyed by <resolution>/<detection box>)
+    report: dict[str, dict[str, int]] = {}
+    lang_path = path.join(base_path, language)
+    if not path.isdir(lang_path):
+        return report
+    for resolution in listdir(lang_path):
+        resolution_path = path.join(lang_path, resolution)
+        if not path.isdir(resolution_path) or not is_resolution(resolution):
+            continue
+        for filename in listdir(resolution_path):
+            detection_box_id, extension = path.splitext(filename)
+            pixelset_path = path.join(resolution_path, filename)
+            if not path.isfile(pixelset_path) or extension != PIXELSET_FILE_EXTENSION or detection_box_id not in DETECTION_BOXES:
+                continue
+            size_before = path.getsize(pixelset_path)
+            group = PixelSetGroup.load(pixelset_path, get_pixelset_shape(resolution, detection_box_id))
+            if len(group.pixelsets) == 0:
+                continue  # Empty, or in a format that cannot be read, leave it untouched
+            stats = compact_pixelset_group(group, detection_box_id, language)
+            group.save()
+            stats["bytes_before"] = size_before
+            stats["bytes_after"] = path.getsize(pixelset_path)
+            report[f"{resolution}/{detection_box_id}"] = stats
+    return report
+
+
+def export_pixelset_pack(base_path: str, language: str, pack_path: str, resolution: str = PIXELSET_CANONICAL_RESOLUTION) -> int:
+    # Writes the pixel sets learned for a language into a pack, returns how many were exported
+    resolution_path = path.join(base_path, language, resolution)
+    detection_boxes: dict[str, int] = {}
+    makedirs(path.dirname(path.abspath(pack_path)), exist_ok=True)
+    with ZipFile(pack_path, "w", compression=ZIP_DEFLATED) as pack:
+        for detection_box_id in DETECTION_BOXES:
+            pixelset_path = path.join(resolution_path, detection_box_id + PIXELSET_FILE_EXTENSION)
+            group = PixelSetGroup.load(pixelset_path, get_pixelset_shape(resolution, detection_box_id))
+            if len(group.pixelsets) == 0:
+                continue
+            detection_boxes[detection_box_id] = len(group.pixelsets)
+            group.release_mapping()
+            pack.write(pixelset_path, detection_box_id + PIXELSET_FILE_EXTENSION)
+        manifest = {"format": PIXELSET_PACK_FORMAT, "version": VERSION, "language": language, "resolution": resolution, "detection_boxes": detection_boxes}
+        pack.writestr(PIXELSET_PACK_MANIFEST, json.dumps(manifest, indent=4))
+    return sum(detection_boxes.values())
+
+
+def read_pack_file(pack: ZipFile, filename: str) -> bytes:
+    try:
+        return pack.read(filename)
+    except KeyError as e:
+        raise ValueError(f"Pixel set pack is missing {filename}") from e
+    except (BadZipFile, ZlibError) as e:
+        raise ValueError(f"Pixel set pack is corrupted: {e}") from e
+
+
+def import_pixelset_pack(base_path: str, pack_path: str, language: str = "") -> int:
+    # Merges the pixel sets of a pack into the library of its language (or of the given one), returns how many were added.
+    # Pixel sets that were already learned are kept, and packs made at another resolution are rescaled to the canonical one.
+    # Every way a pack can be unusable is reported as a ValueError
+    try:
+        pack = ZipFile(pack_path, "r")
+    except BadZipFile as e:
+        raise ValueError(f"Not a pixel set pack: {pack_path}") from e
+    with pack:
+        manifest: dict = json.loads(read_pack_file(pack, PIXELSET_PACK_MANIFEST).decode("utf-8"))
+        if not isinstance(manifest, dict) or manifest.get("format") != PIXELSET_PACK_FORMAT:
+            raise ValueError(f"Unsupported pixel set pack format: {manifest.get('format') if isinstance(manifest, dict) else None}")
+        # The language and resolution end up in the paths that are written to, so only known values are accepted
+        language = language or manifest.get("language", "")
+        if language not in LANGUAGES:
+            raise ValueError(f"Invalid pixel set pack language: {language}")
+        resolution = manifest.get("resolution", "")
+        if not isinstance(resolution, str) or not is_resolution(resolution):
+            raise ValueError(f"Invalid pixel set pack resolution: {resolution}")
+        detection_boxes = manifest.get("detection_boxes")
+        if not isinstance(detection_boxes, (dict, list)):
+            raise ValueError("Invalid pixel set pack detection boxes")
+        imported = 0
+        for detection_box_id in detection_boxes:
+            if not isinstance(detection_box_id, str) or detection_box_id not in DETECTION_BOXES:
+                continue
+            source_shape = get_pixelset_shape(resolution, detection_box_id)
+            pixelsets = read_pixelsets(read_pack_file(pack, detection_box_id + PIXELSET_FILE_EXTENSION), source_shape)
+            if len(pixelsets) == 0:
+                continue
+            pixelset_path = path.join(base_path, language, PIXELSET_CANONICAL_RESOLUTION, detection_box_id + PIXELSET_FILE_EXTENSION)
+            group = PixelSetGroup.load(pixelset_path, get_canonical_pixelset_shape(detection_box_id))
+            added = 0
+            for identifier, pixelset in pixelsets.items():
+                if identifier in group.pixelsets:
+                    continue
+                pixelset = rescale_pixelset(pixelset.copy(), source_shape, group.shape)
+                if popcount(pixelset) >= 10:
+                    group.set(identifier, pixelset)
+                    added += 1
+            if added > 0:
+                group.save()
+            imported += added
+    return imported
+
+
+class PixelSetCache:
+    def __init__(self, base_path: str, language: str, debug: bool = False, writer: PixelSetWriter | None = None, packs_path: str = ""):
+        self.base_path: str = base_path
+        self.lang_path: str = path.join(base_path, language)
+        self.debug: bool = debug
+        self.writer: PixelSetWriter | None = writer
+        self.packs_path: str = packs_path
+        self.cache: dict[str, dict[str, PixelSetGroup]] = {}
+        self.import_bundled_pack(language)
+        if not path.exists(self.lang_path):
+            return
+        self.init()
+
+    def import_bundled_pack(self, language: str) -> None:
+        # A language without any learned pixel set starts from the pack shipped with the program, if there is one
+        pack_path = path.join(self.packs_path, language + ".zip")
+        if self.packs_path == "" or not path.isfile(pack_path):
+            return
+        canonical_path = path.join(self.lang_path, PIXELSET_CANONICAL_RESOLUTION)
+        if path.isdir(canonical_path) and any(filename.endswith(PIXELSET_FILE_EXTENSION) for filename in listdir(canonical_path)):
+            return
+        try:
+            imported = import_pixelset_pack(self.base_path, pack_path, language)
+        except Exception as e:
+            print(f"Failed to import pixel set pack {pack_path}: {e}")
+            return
+        if self.debug:
+            print(f"Imported {imported} pixel sets from {pack_path}")
+
+    def init(self):
+        if self.debug:
+            print("Loading pixel sets to cache...")
+        self.cache.clear()
+        makedirs(self.lang_path, exist_ok=True)
+        for resolution in listdir(self.lang_path):
+            resolution_path = path.join(self.lang_path, resolution)
+            if not path.isdir(resolution_path) or not is_resolution(resolution):
+                continue
+            for filename in listdir(resolution_path):
+                detection_box_id, extension = path.splitext(filename)
+                pixelset_path = path.join(resolution_path, filename)
+                if not path.isfile(pixelset_path) or extension != PIXELSET_FILE_EXTENSION or detection_box_id not in DETECTION_BOXES:
+                    continue
+                if resolution not in self.cache:
+                    self.cache[resolution] = {}
+                group = PixelSetGroup.load(pixelset_path, get_pixelset_shape(resolution, detection_box_id))
+                self.cache[resolution][detection_box_id] = group
+                if self.debug:
+                    print(f"Loaded {len(group.pixelsets)} pixel sets: {resolution}/{filename}")
+        if self.debug:
+            print("Finished loading pixel sets to cache.")
+
+    def change_language(self, language: str) -> None:
+        self.flush()  # Make sure that the files about to be loaded are up to date
+        self.lang_path = path.join(self.base_path, language)
+        self.import_bundled_pack(language)
+        self.init()
+
+    def flush(self) -> None:
+        if self.writer is not None and self.writer.is_alive():
+            self.writer.flush()
+
+    def get_pixelset(self, resolution: str, detection_box_id: str, identifier: str) -> ndarray | None:
+        if resolution in self.cache and detection_box_id in self.cache[resolution]:
+            return self.cache[resolution][detection_box_id].pixelsets.get(identifier)
+        return None
+
+    def get_pixelsets(self, resolution: str, detection_box_id: str) -> dict[str, ndarray]:
+        if resolution in self.cache and detection_box_id in self.cache[resolution]:
+            return self.cache[resolution][detection_box_id].pixelsets
+        return {}
+
+    def get_pixelset_group(self, resolution: str, detection_box_id: str) -> PixelSetGroup | None:
+        if resolution in self.cache and detection_box_id in self.cache[resolution]:
+            return self.cache[resolution][detection_box_id]
+        return None
+
+    def get_or_create_pixelset_group(self, resolution: str, detection_box_id: str) -> PixelSetGroup:
+        if resolution not in self.cache:
+            self.cache[resolution] = {}
+        if detection_box_id not in self.cache[resolution]:
+            filepath = path.join(self.lang_path, resolution, detection_box_id + PIXELSET_FILE_EXTENSION)
+            self.cache[resolution][detection_box_id] = PixelSetGroup(get_pixelset_shape(resolution, detection_box_id), filepath)
+        return self.cache[resolution][detection_box_id]
+
+    def set_pixelset(self, resolution: str, detection_box_id: str, identifier: str, pixelset: ndarray) -> None:
+        group = self.get_or_create_pixelset_group(resolution, detection_box_id)
+        if popcount(pixelset) < 10:
+            return
+        group.set(identifier, pixelset)
+
+    def save_pixelset(self, resolution: str, detection_box_id: str, identifier: str, pixelset: ndarray) -> None:
+        group = self.get_or_create_pixelset_group(resolution, detection_box_id)
+        group.set(identifier, pixelset)
+        if self.writer is not None and self.writer.is_alive():
+            self.writer.schedule(group)
+        else:
+            group.save()  # Write-through to disk
+
+    def clear_cache(self) -> None:
+        self.cache = {}
+
+    def all_characters_learned(self) -> bool:
+        resolution = PIXELSET_CANONICAL_RESOLUTION
+        detection_box_id = MENU_DETECTION
+        pixelsets: dict[str, ndarray] = self.get_pixelsets(resolution, detection_box_id)
+        return all(character in pixelsets for character in get_all_character_names())
+
+
+class PixelSet:
+    def __init__(
+        self,
+        cache: PixelSetCache | None,  # None for a pixel set that is only built from a crop, never learned nor matched (ex: by the trainer)
+        cropped: ndarray,
+        detection_id: str,
+    ):
+        self.cache: PixelSetCache | None = cache
+        # Pixel sets are always learned and matched at the canonical scale, so that they can be shared by every resolution
+        self.resolution: str = PIXELSET_CANONICAL_RESOLUTION
+        self.cropped: ndarray = rescale_crop(cropped, get_canonical_pixelset_shape(detection_id))
+        self.detection_id: str = detection_id
+        self.fn_rate: float = PIXELSET_FN_RATES[detection_id]
+        self.fp_rate: float = PIXELSET_FP_RATES[detection_id]
+        self.pixelset_threshold: int = PIXELSET_THRESHOLDS[detection_id]
+        threshold_reduction: int = PIXELSET_THRESHOLD_REDUCTIONS[detection_id]
+        _, self.image = threshold(self.cropped, self.pixelset_threshold - threshold_reduction, 255, THRESH_BINARY)
+        self.height, self.width = self.cropped.shape[:2]
+        self.pixelset: ndarray = pack_bitmap(self.image)
+        self.pixel_count: int = popcount(self.pixelset)
+        self.signature: ndarray = get_pixelset_signature(self.image)
+        # The crop can be a pixel or two off from the learned one (coordinate rounding, UI animations),
+        # so it is also matched with every offset within the tolerance, the unshifted one first.
+        tolerance: int = PIXELSET_SHIFT_TOLERANCES[detection_id]
+        offsets: list[tuple[int, int]] = [(0, 0)] + [(dy, dx) for dy in range(-tolerance, tolerance + 1) for dx in range(-tolerance, tolerance + 1) if (dy, dx) != (0, 0)]
+        shifted_images: list[ndarray] = [shift_bitmap(self.image, dy, dx) for dy, dx in offsets[1:]]
+        self.shifted_pixelsets: ndarray = vstack([self.pixelset] + [pack_bitmap(image) for image in shifted_images])
+        self.shifted_pixel_counts: ndarray = POPCOUNT_TABLE[self.shifted_pixelsets].sum(axis=1, dtype=int64)
+        self.shifted_signatures: ndarray = vstack([self.signature] + [get_pixelset_signature(image) for image in shifted_images])
+
+    def size(self) -> int:
+        return self.pixel_count
+
+    def get_reference(self) -> ndarray | None:
+        # The pixel set as it is stored when learned (with the full threshold), or None if it has too few pixels to be learned
+        _, ref_image = threshold(self.cropped, self.pixelset_threshold, 255, THRESH_BINARY)
+        ref_pixelset: ndarray = pack_bitmap(ref_image)
+        if popcount(ref_pixelset) < 10:
+            return None  # Require at least 10 pixels to write
+        return ref_pixelset
+
+    def write(self, identifier: str) -> None:
+        ref_pixelset: ndarray | None = self.get_reference()
+        if ref_pixelset is None or self.cache is None:
+            return
+        self.cache.save_pixelset(self.resolution, self.detection_id, identifier, ref_pixelset)
+
+    def find_match(self, detection_id: str, exhaustive: bool = True) -> str:
+        if self.pixel_count < 10 or self.cache is None:
+            return ""
+        group: PixelSetGroup | None = self.cache.get_pixelset_group(self.resolution, self.detection_id)
+        if group is None:
+            return ""
+        identifier: str | None = group.find_match(self.shifted_pixelsets, self.shifted_pixel_counts, self.shifted_signatures, self.fn_rate, self.fp_rate, exhaustive)
+        if identifier is None:
+            return ""  # No match found
+        if detection_id in ARMAMENT_DETECTION_IDS:
+            try:
+                return find_grabbable_name_by_id(parse_pixelset_identifier(detection_id, identifier))
+            except:
+                return ""
+        return identifier
@@ -0,0 +1,141 @@
+from collections import Counter
+from numpy import ndarray, array, zeros, nonzero, minimum, add, int64, float64
+from re import compile
+from threading import Lock
+from typing import Iterable, Callable, Any
+from lib.constants import *
+
+# Text matching compares the characters of two texts as multisets: similarity = |A ∩ B| / |A ∪ B| (their Jaccard similarity).
+# Since |A ∩ B| <= min(|A|, |B|), a text of length |A| can only reach a threshold t against texts of length within
+# [t * |A|, |A| / t], and only texts sharing at least one character with it have any intersection.
+# TextMatchIndex keeps, for every character, which texts contain it and how many times, so that the intersections with every
+# text are accumulated from the characters of the OCR text alone, and only the texts that can reach the threshold are scored.
+
+# Number of search spaces whose index is kept (ex: the grabbable and character specs of the current language)
+TEXT_MATCH_INDEX_CACHE_SIZE = 8
+
+
+# Language specific cleanup of the texts, on top of the common one (surrounding whitespace and casing)
+TEXT_NORMALIZATION_RULES: dict[str, dict[str, Any]] = {
+    "engus": {  # Optimizations for the default language (English)
+        "ocr_replacements": (("’", "'"), ("‘", "'"), ("!", "L"), ("+", "T")),  # Common misreads, only applied to OCR text
+        "replacements": (("É", "E"), ("é", "E")),
+        "removed_characters": compile(r"[^a-zA-Z\s\'\-\.]"),  # Will mainly remove: []0-9
+    },
+}
+WHITESPACE_PATTERN = compile(r"\s+")
+
+
+def normalize_target_text(text: str, language: str) -> str:
+    clean_text: str = text.strip().upper()
+    rules: dict[str, Any] | None = TEXT_NORMALIZATION_RULES.get(language)
+    if rules is not None:
+        for old, new in rules["replacements"]:
+            clean_text = clean_text.replace(old, new)
+        clean_text = rules["removed_characters"].sub("", clean_text)
+    return clean_text
+
+
+def normalize_ocr_text(text: str, language: str) -> str:
+    clean_text: str = text.strip().upper()
+    rules: dict[str, Any] | None = TEXT_NORMALIZATION_RULES.get(language)
+    if rules is not None:
+        for old, new in rules["ocr_replacements"] + rules["replacements"]:
+            clean_text = clean_text.replace(old, new)
+        clean_text = rules["removed_characters"].sub("", clean_text)
+    return WHITESPACE_PATTERN.sub(" ", clean_text)
+
+
+class TextMatchIndex:
+    def __init__(self, texts: Iterable[str], language: str):
+        # The texts are normalized once here, so that matching OCR text against them does not normalize them again
+        self.language: str = language
+        normalized_texts: list[tuple[str, Counter]] = []
+        for text in texts:
+            clean_text = normalize_target_text(text, language)
+            normalized_texts.append((clean_text, Counter(clean_text)))
+        self.texts: list[str] = [text for text, _ in normalized_texts]
+        self.lengths: ndarray = array([len(text) for text in self.texts], dtype=int64)
+        self.first_index: dict[str, int] = {}  # First position of every text, for exact matches
+        postings: dict[str, tuple[list[int], list[int]]] = {}
+        for i, (text, characters) in enumerate(normalized_texts):
+            self.first_index.setdefault(text, i)
+            for character, count in characters.items():
+                indexes, counts = postings.setdefault(character, ([], []))
+                indexes.append(i)
+                counts.append(count)
+        self.postings: dict[str, tuple[ndarray, ndarray]] = {
+            character: (array(indexes, dtype=int64), array(counts, dtype=int64)) for character, (indexes, counts) in postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def get_candidates(self, rough_text: str, threshold: float) -> tuple[ndarray, ndarray]:
+        # Positions of the texts that can reach the threshold against rough_text (already normalized), with their similarity
+        length = len(rough_text)
+        intersections: ndarray = zeros(len(self.texts), dtype=int64)
+        for character, count in Counter(rough_text).items():
+            if character in self.postings:
+                indexes, counts = self.postings[character]
+                add.at(intersections, indexes, minimum(counts, count))
+        lengths = self.lengths
+        within_length = (lengths >= threshold * length - 1e-9) & (threshold * lengths <= length + 1e-9)
+        candidates: ndarray = nonzero(within_length & (intersections > 0))[0]
+        candidate_intersections = intersections[candidates].astype(float64)
+        # Same operations as textdistance's jaccard.normalized_similarity (which matching used to rely on), so that the similarities are identical to the last bit
+        similarities: ndarray = 1 - (1 - candidate_intersections / (length + lengths[candidates] - candidate_intersections))
+        valid = similarities >= threshold
+        return candidates[valid], similarities[valid]
+
+    def find(self, clean_rough_text: str, threshold: float, exhaustive: bool = True) -> tuple[int, int]:
+        # Returns (match result, position of the matching text), with the same choice as comparing the (normalized) OCR text with every text
+        # in order: the first exact match, otherwise the first text with the highest similarity (or the first one reaching the threshold if not exhaustive)
+        exact: int | None = self.first_index.get(clean_rough_text)
+        if clean_rough_text == "":
+            # The empty text has no character in common with any other, it can only match itself
+            return (PERFECT_MATCH, exact) if exact is not None else (NO_MATCH, -1)
+        candidates, similarities = self.get_candidates(clean_rough_text, threshold)
+        if candidates.size == 0:
+            return (NO_MATCH, -1)
+        if not exhaustive:
+            first = int(candidates[0])  # Candidates are in search space order
+            return (PERFECT_MATCH if self.texts[first] == clean_rough_text else GOOD_MATCH, first)
+        if exact is not None:
+            return (PERFECT_MATCH, exact)
+        return (GOOD_MATCH, int(candidates[int(similarities.argmax())]))
+
+
+# Text getters of the search spaces. Matches and indexes are cached by the getter they were made with, so callers must pass one of
+# these (or another module-level function), never a lambda, which would be a new object on every call and never hit the caches.
+def get_text_itself(text: str) -> str:
+    return text
+
+
+def get_spec_name(spec: dict) -> str:
+    return spec["name"]
+
+
+def get_spec_id(spec: dict) -> int | str:
+    return spec["id"]
+
+
+TEXT_MATCH_INDEXES: dict[tuple[int, str, Any], tuple[tuple, TextMatchIndex]] = {}
+TEXT_MATCH_INDEXES_LOCK: Lock = Lock()
+
+
+def get_text_match_index(search_space: tuple, get_text: Callable, language: str) -> TextMatchIndex:
+    # Indexes are cached by the identity of the search space, which is why only immutable search spaces (tuples) are cached.
+    # The search space is kept along with its index, so that its identity cannot be reused by another object.
+    # get_text must be a module-level function (see get_spec_name), the cached indexes are told apart by it.
+    key = (id(search_space), language, get_text)
+    with TEXT_MATCH_INDEXES_LOCK:
+        cached = TEXT_MATCH_INDEXES.get(key)
+        if cached is not None and cached[0] is search_space:
+            return cached[1]
+    index = TextMatchIndex((get_text(item) for item in search_space), language)
+    with TEXT_MATCH_INDEXES_LOCK:
+        if len(TEXT_MATCH_INDEXES) >= TEXT_MATCH_INDEX_CACHE_SIZE:
+            del TEXT_MATCH_INDEXES[next(iter(TEXT_MATCH_INDEXES))]  # Drop the oldest one
+        TEXT_MATCH_INDEXES[key] = (search_space, index)
+    return index
@@ -0,0 +1,161 @@
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from typing import Any
+from numpy import ndarray, array_equal
+from os import path, environ, cpu_count
+from pytesseract import pytesseract
+from lib.capture import Frame, FrameSource
+from lib.constants import *
+from lib.characters import *
+from lib.armaments import *
+from lib.misc import find_match, get_detection_box_coordinates, get_image_hash, are_hashes_different
+from lib.pixelsets import *
+from lib.detection import get_ocr_image, has_enough_pixels, get_armament_detection_ids, get_search_space, get_menu_state, get_pixelset_identifier
+from lib.ocr import OcrBackend, create_ocr_backend, prepare_ocr_image
+
+# Learns pixel sets from recorded frames instead of live during play. Frames are read in order by the main process,
+# which only crops the detection boxes; the OCR and matching of each frame is done by a pool of worker processes.
+# Every frame is handled on its own: the menu title read in a frame decides which armament boxes are read in that same frame.
+
+# Number of frames queued per worker, bounds the memory used while the workers catch up with the frame source
+TRAINER_FRAMES_PER_WORKER = 4
+
+trainer_language: str = DEFAULT_LANGUAGE
+trainer_ocr_backend: OcrBackend
+
+
+def init_trainer_worker(resources_path: str, language: str, tesseract_cmd: str, tessdata_path: str, ocr_backend: str) -> None:
+    global trainer_language, trainer_ocr_backend
+    trainer_language = language
+    pytesseract.tesseract_cmd = tesseract_cmd
+    environ["TESSDATA_PREFIX"] = tessdata_path
+    # Every worker keeps its own engine, so the language model is only loaded once per worker
+    trainer_ocr_backend = create_ocr_backend(ocr_backend, tessdata_path, TESSERACT_CONFIG, TESSERACT_TIMEOUT)
+    load_all_character_specs(resources_path, language)
+    load_all_grabbable_specs(resources_path, language)
+
+
+def get_training_boxes(frame: Frame) -> dict[str, ndarray]:
+    # Crops of every detection box the trainer may need, the armament box that is actually read depends on the menu state
+    crops: dict[str, ndarray] = {}
+    for detection_box_id in DETECTION_BOXES:
+        top, bottom, left, right = get_detection_box_coordinates(detection_box_id, frame.width, frame.height)
+        cropped = frame.crop(top, bottom, left, right)
+        if cropped is not None:
+            crops[detection_box_id] = cropped.copy()
+    return crops
+
+
+def read_detection_box(crops: dict[str, ndarray], detection_box_id: str) -> tuple[str, PixelSet | None]:
+    # Same steps as the live detection: pixel count check, then OCR. The pixel set is not bound to a cache, it is only learned from.
+    if detection_box_id not in crops:
+        return "", None
+    pixel_set = PixelSet(None, crops[detection_box_id], detection_box_id)
+    if not has_enough_pixels(pixel_set, detection_box_id):
+        return "", None
+    text = trainer_ocr_backend.recognize(prepare_ocr_image(get_ocr_image(crops[detection_box_id])), TESSERACT_LANGUAGES[trainer_language])
+    return text.strip(), pixel_set
+
+
+def learn_from_box(learned: list[tuple[str, int | str, ndarray]], crops: dict[str, ndarray], detection_box_id: str, language: str) -> tuple[int, Any]:
+    # Reads and matches one detection box, learns its pixel set under the same rule as the live detection, and returns the match
+    text, pixel_set = read_detection_box(crops, detection_box_id)
+    search_space, get_text = get_search_space(detection_box_id, language)
+    match_result, match = find_match(detection_box_id, language, TEXT_ORIGIN_OCR, text, search_space, get_text)
+    identifier = get_pixelset_identifier(detection_box_id, TEXT_ORIGIN_OCR, match_result, match)
+    if pixel_set is not None and identifier is not None:
+        reference = pixel_set.get_reference()
+        if reference is not None:
+            learned.append((detection_box_id, identifier, reference))
+    return match_result, match
+
+
+def train_on_frame(crops: dict[str, ndarray]) -> list[tuple[str, int | str, ndarray]]:
+    # Returns the (detection box, identifier, reference pixel set) learned from the crops of one frame
+    learned: list[tuple[str, int | str, ndarray]] = []
+    language = trainer_language
+    menu_state = get_menu_state(*learn_from_box(learned, crops, MENU_DETECTION, language))
+    learn_from_box(learned, crops, CHARACTER_DETECTION, language)
+    for detection_box_id in get_armament_detection_ids(menu_state):
+        learn_from_box(learned, crops, detection_box_id, language)
+    return learned
+
+
+def train_pixelsets(
+    source: FrameSource,
+    output_path: str,
+    language: str,
+    resources_path: str,
+    tesseract_cmd: str,
+    tessdata_path: str,
+    ocr_backend: str,
+    workers: int | None = None,
+) -> dict[str, int]:
+    # Learns pixel sets from every frame of the source, and adds the ones that are missing to the library at output_path
+    groups: dict[str, PixelSetGroup] = {}
+    for detection_box_id in DETECTION_BOXES:
+        filepath = path.join(output_path, language, PIXELSET_CANONICAL_RESOLUTION, detection_box_id + PIXELSET_FILE_EXTENSION)
+        groups[detection_box_id] = PixelSetGroup.load(filepath, get_canonical_pixelset_shape(detection_box_id))
+    stats: dict[str, int] = {"frames": 0, "unchanged_frames": 0, "failed_frames": 0, "learned": 0}
+    previous_crops: dict[str, ndarray] = {}
+    previous_hashes: dict[str, ndarray] = {}
+
+    def collect(frame_number: int, future: Future) -> None:
+        # Results are collected in frame order, so the first frame an identifier was read in is the one that is kept.
+        # A frame that fails (OCR timeout, missing language data, crashed worker) is counted and skipped, the others are still learned.
+        try:
+            learned = future.result()
+        except Exception as e:
+            stats["failed_frames"] += 1
+            print(f"Failed to read frame {frame_number}: {type(e).__name__}: {e}")
+            return
+        for detection_box_id, identifier, reference in learned:
+            if identifier not in groups[detection_box_id].pixelsets:
+                groups[detection_box_id].set(identifier, reference)
+                stats["learned"] += 1
+
+    workers = workers or cpu_count() or 1
+    initargs = (resources_path, language, tesseract_cmd, tessdata_path, ocr_backend)
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_trainer_worker, initargs=initargs) as executor:
+            pending: deque[tuple[int, Future]] = deque()
+            max_pending = workers * TRAINER_FRAMES_PER_WORKER
+            while True:
+                img = source.grab()
+                if img is None:
+                    break
+                stats["frames"] += 1
+                frame = Frame.full(stats["frames"], 0, img)
+                crops = get_training_boxes(frame)
+                # Consecutive frames are often identical (static menus), those do not need to be read again.
+                # The hashes only filter out the frames that changed, different texts can share the same hash.
+                hashes = {detection_box_id: get_image_hash(cropped) for detection_box_id, cropped in crops.items()}
+                if (
+                    hashes.keys() == previous_hashes.keys()
+                    and not any(are_hashes_different(previous_hashes[key], hashes[key]) for key in hashes)
+                    and all(array_equal(previous_crops[key], crops[key]) for key in crops)
+                ):
+                    stats["unchanged_frames"] += 1
+                    continue
+                previous_hashes, previous_crops = hashes, crops
+                try:
+                    pending.append((stats["frames"], executor.submit(train_on_frame, crops)))
+                except BrokenProcessPool as e:
+                    # No worker is left to read the remaining frames, what was learned so far is still saved
+                    stats["failed_frames"] += 1
+                    print(f"Failed to read frame {stats['frames']}: {type(e).__name__}: {e}")
+                    break
+                while len(pending) >= max_pending:
+                    collect(*pending.popleft())
+            while len(pending) > 0:
+                collect(*pending.popleft())
+    finally:
+        source.close()
+        # Saved even if the run is interrupted, so that what was learned until then is kept
+        for group in groups.values():
+            if len(group.pixelsets) > 0:
+                group.save()
+    for detection_box_id, group in groups.items():
+        stats[detection_box_id] = len(group.pixelsets)
+    return stats
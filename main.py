@@ -1,16 +1,18 @@
 # --------------------------- Imports --------------------------#
 from tkinter import Tk, Toplevel, Button, Label, StringVar, OptionMenu, PhotoImage, Frame, LEFT, TOP, RAISED
 from threading import Thread, Event, Lock
+from concurrent.futures import TimeoutError as FutureTimeoutError, CancelledError
 from argparse import ArgumentParser
+from multiprocessing import freeze_support
 from traceback import format_exc
-from numpy import ndarray, array
+from numpy import ndarray, array_equal
 from time import time, sleep
 from os import path, makedirs
 from shutil import rmtree, move
 from datetime import datetime
 from PIL import ImageGrab
 from pytesseract import pytesseract
-from cv2 import cvtColor, threshold, bitwise_and, resize, COLOR_BGR2GRAY, THRESH_BINARY_INV, INTER_AREA
+from cv2 import bitwise_and
 from inspect import getfullargspec
 from os import getenv
 import json
@@ -18,10 +20,15 @@ import sys
 
 # ---------------------- Project Imports -----------------------#
 from lib.debug import DebugWindow
+from lib.capture import Frame as CaptureFrame, FrameBus, FrameSource, ScreenFrameSource, open_frame_source
 from lib.constants import *
 from lib.characters import *
 from lib.default_extension import *
 from lib.misc import *
+from lib.pixelsets import *
+from lib.trainer import train_pixelsets
+from lib.ocr import *
+from lib.detection import *
 
 # ------------------------ Constants ---------------------------#
 
@@ -34,6 +41,7 @@ else:
     PROGRAM_DATA_PATH: str = path.join(BASE_PATH, "temp")
 
 PIXEL_SETS_PATH: str = path.join(PROGRAM_DATA_PATH, "pixel_sets")
+OCR_CACHE_PATH: str = path.join(PROGRAM_DATA_PATH, "ocr_cache")
 TESSDATA_PATH: str = path.join(PROGRAM_DATA_PATH, "languages")
 DEBUG_PATH: str = path.join(PROGRAM_DATA_PATH, "debug")
 RESOURCES_PATH: str = path.join(BASE_PATH, "resources")
@@ -44,16 +52,53 @@ ERROR_LOG_PATH: str = path.join(PROGRAM_DATA_PATH, f"error_log_{PROGRAM_START_TI
 
 TESSERACT_PATH: str = path.join(RESOURCES_PATH, "Tesseract-OCR", "tesseract.exe")
 ICON_PATH: str = path.join(RESOURCES_PATH, "icon.png")
+PIXEL_SET_PACKS_PATH: str = path.join(RESOURCES_PATH, "pixel_set_packs")
 
-pytesseract.tesseract_cmd = TESSERACT_PATH
+if sys.platform == "win32":  # Otherwise rely on a tesseract installation available in the PATH (ex: when replaying on Linux)
+    pytesseract.tesseract_cmd = TESSERACT_PATH
 pytesseract.environ["TESSDATA_PREFIX"] = TESSDATA_PATH
 
 DEBUG: bool = False
+HEADLESS: bool = False
+CAPTURE_MODE: str = CAPTURE_MODE_REGION
+REPLAY_PATH: str = ""
+REPLAY_FPS: float = 0
+COMPACT_PIXELSETS: bool = False
+EXPORT_PIXELSET_PACK_PATH: str = ""
+IMPORT_PIXELSET_PACK_PATH: str = ""
+TRAIN_PATH: str = ""
+TRAIN_OUTPUT_PATH: str = ""
+TRAIN_WORKERS: int = 0
+OCR_BACKEND: str = OCR_BACKEND_PYTESSERACT
+PERSIST_OCR_CACHE: bool = False
 if __name__ == "__main__":
     parser = ArgumentParser(description="Run Nightreign Armament Helper Overlay.")
     parser.add_argument("-d", "--debug", action="store_true", help="Enable debug mode.")
+    parser.add_argument("--capture-mode", choices=CAPTURE_MODES, default=CAPTURE_MODE_REGION, help="Capture the whole screen or only the regions being read.")
+    parser.add_argument("--replay", default="", help="Run the detection pipeline headlessly over a directory of screenshots or a video file, instead of the screen.")
+    parser.add_argument("--replay-fps", type=float, default=0, help="Frames per second to replay at (0 means as fast as possible).")
+    parser.add_argument("--compact-pixelsets", action="store_true", help="Remove redundant and unusable learned pixel sets, then exit.")
+    parser.add_argument("--export-pixelset-pack", default="", help="Export the pixel sets learned for the selected language into a pack file, then exit.")
+    parser.add_argument("--import-pixelset-pack", default="", help="Add the pixel sets of a pack file to the ones already learned, then exit.")
+    parser.add_argument("--train", default="", help="Learn pixel sets from a directory of screenshots or a video file, using every CPU core, then exit.")
+    parser.add_argument("--train-output", default="", help="Pixel sets directory that --train adds the learned pixel sets to (defaults to the program's own).")
+    parser.add_argument("--workers", type=int, default=0, help="Number of worker processes used by --train (0 means one per CPU core).")
+    parser.add_argument("--persist-ocr-cache", action="store_true", help="Keep the text read for every image across runs, per language and resolution.")
+    parser.add_argument("--ocr-backend", choices=OCR_BACKENDS, default=OCR_BACKEND_PYTESSERACT, help="Run Tesseract as a new process for every read (pytesseract), or in-process (tesserocr, kept loaded across reads, but without a timeout on reads).")
     args = parser.parse_args()
     DEBUG = args.debug
+    CAPTURE_MODE = args.capture_mode
+    REPLAY_PATH = args.replay
+    REPLAY_FPS = args.replay_fps
+    COMPACT_PIXELSETS = args.compact_pixelsets
+    EXPORT_PIXELSET_PACK_PATH = args.export_pixelset_pack
+    IMPORT_PIXELSET_PACK_PATH = args.import_pixelset_pack
+    TRAIN_PATH = args.train
+    TRAIN_OUTPUT_PATH = args.train_output
+    TRAIN_WORKERS = args.workers
+    OCR_BACKEND = args.ocr_backend
+    PERSIST_OCR_CACHE = args.persist_ocr_cache
+    HEADLESS = REPLAY_PATH != "" or COMPACT_PIXELSETS or EXPORT_PIXELSET_PACK_PATH != "" or IMPORT_PIXELSET_PACK_PATH != "" or TRAIN_PATH != ""
 
 # ---------------------- Global Variables ----------------------#
 
@@ -84,6 +129,16 @@ previous_imgs: dict[str, ndarray | None] = {
     CHARACTER_DETECTION: None,
 }
 
+# Hashes of the crops that produced previous_imgs, so that only the new crop has to be hashed on each detection
+previous_hashes: dict[str, ndarray | None] = {
+    ARMAMENT_DETECTION_DEFAULT: None,
+    ARMAMENT_DETECTION_DEFAULT_REPLACE: None,
+    ARMAMENT_DETECTION_BOSS_DROP: None,
+    ARMAMENT_DETECTION_SHOP: None,
+    MENU_DETECTION: None,
+    CHARACTER_DETECTION: None,
+}
+
 previous_matches_lock: Lock = Lock()
 previous_matches: dict[str, tuple[int, str]] = {
     ARMAMENT_DETECTION_DEFAULT: (TEXT_ORIGIN_NONE, ""),
@@ -107,8 +162,8 @@ last_pixelsets: dict[str, PixelSet | None] = {
 root: Tk
 screen_width_ui: int
 screen_height_ui: int
-screen_width_real: int
-screen_height_real: int
+screen_width_real: int = 0
+screen_height_real: int = 0
 basic_armament_feedback_label: Label
 advanced_armament_feedback_label: Label
 replace_basic_armament_feedback_label: Label
@@ -116,11 +171,19 @@ replace_advanced_armament_feedback_label: Label
 current_character_var: StringVar
 current_character_dropdown: OptionMenu | None = None
 
-last_screengrab: Image.Image | None = None
-last_screengrab_time: float = 0.0
-screengrab_lock: Lock = Lock()
+frame_source: FrameSource = ScreenFrameSource()
+frame_bus: FrameBus = FrameBus()
+capture_regions: list[tuple[int, int, int, int]] = []
+capture_regions_key: tuple | None = None
 pixelset_cache: PixelSetCache
+pixelset_writer: PixelSetWriter
 button_detection_required: bool = False
+button_check_lock: Lock = Lock()
+button_check_sequence: int = -1
+button_check_passed: bool = True
+button_template_bank: ButtonTemplateBank = ButtonTemplateBank(path.join(RESOURCES_PATH, "buttons"))
+ocr_result_cache: OcrResultCache
+ocr_pool: OcrPool
 image_cache: ImageCache = ImageCache()
 
 extension_load_mode: str = ""
@@ -192,6 +255,12 @@ def load_configs() -> None:
                             elif name == "SHOP":
                                 name = SHOP_LANGUAGES["engus"]
                                 move(path.join(menu_detection_path, file), path.join(menu_detection_path, name + extension))
+                if version_is_older(data_version, "2.5.0"):
+                    # Pack the one-file-per-identifier pixel sets into a single binary file per detection box
+                    migrate_legacy_pixelsets(PIXEL_SETS_PATH)
+                if version_is_older(data_version, "2.6.0"):
+                    # Pixel sets are no longer kept per resolution, rescale them all to the canonical resolution
+                    migrate_pixelsets_to_canonical(PIXEL_SETS_PATH)
             if data_version != VERSION:
                 save_configs()
     except (FileNotFoundError, json.JSONDecodeError):
@@ -251,6 +320,16 @@ def create_character_dropdown() -> None:
     root.update_idletasks()
 
 
+def reset_previous_detections() -> None:
+    global previous_imgs, previous_hashes, previous_matches, last_pixelsets
+    with previous_imgs_lock, previous_matches_lock, last_pixelsets_lock:
+        for detection_id in previous_imgs:
+            previous_imgs[detection_id] = None
+            previous_hashes[detection_id] = None
+            previous_matches[detection_id] = (TEXT_ORIGIN_NONE, "")
+            last_pixelsets[detection_id] = None
+
+
 def on_language_selected(e) -> None:
     global selected_language, language_var
     with selected_language_lock:
@@ -260,15 +339,33 @@ def on_language_selected(e) -> None:
         selected_language = selected
         load_all_character_specs(RESOURCES_PATH, selected_language)
         load_all_grabbable_specs(RESOURCES_PATH, selected_language)
+        MATCH_CACHE.clear()  # Matches point to the specs of the previous language
+        reset_previous_detections()  # As do the texts of the previous detections
         create_character_dropdown()
         pixelset_cache.change_language(selected_language)
+        if PERSIST_OCR_CACHE:
+            ocr_result_cache.load(OCR_CACHE_PATH, selected_language)
         download_tessdata(selected_language, TESSDATA_PATH)
         save_configs()
 
 
+def save_ocr_result_cache() -> None:
+    if not PERSIST_OCR_CACHE:
+        return
+    try:
+        ocr_result_cache.save(OCR_CACHE_PATH)
+    except OSError as e:
+        log_error(e)
+
+
 def quit_app() -> None:
-    global root, character_detection_thread, menu_detection_thread, armament_detection_thread, replace_armament_detection_thread
+    global root, capture_thread, character_detection_thread, menu_detection_thread, armament_detection_thread, replace_armament_detection_thread
     root.quit()
+    pixelset_writer.flush()
+    pixelset_writer.stop()
+    ocr_pool.shutdown()
+    save_ocr_result_cache()
+    capture_thread.stop()
     character_detection_thread.stop()
     menu_detection_thread.stop()
     armament_detection_thread.stop()
@@ -371,6 +468,8 @@ def update_armament_feedback_labels(character_spec: dict | None = None, grabbabl
 
 
 def update_armament_feedback_labels_general(detection_id: str, character_spec: dict | None = None, grabbable_spec: dict | None = None) -> None:
+    if HEADLESS:
+        return
     if detection_id == ARMAMENT_DETECTION_DEFAULT:
         update_armament_feedback_labels(character_spec, grabbable_spec)
     elif detection_id == ARMAMENT_DETECTION_DEFAULT_REPLACE:
@@ -418,6 +517,8 @@ def update_replace_armament_feedback_labels(character_spec: dict | None = None,
 
 
 def update_current_character_dropdown(character: dict | None) -> None:
+    if HEADLESS:
+        return
     if character is None:
         current_character_var.set(NO_CHARACTER)
     else:
@@ -455,11 +556,14 @@ def toggle_advanced_mode() -> None:
 
 
 def toggle_enabled() -> None:
-    global enabled, enable_disable_button, character_detection_thread, menu_detection_thread, armament_detection_thread, replace_armament_detection_thread, root
+    global enabled, enable_disable_button, capture_thread, character_detection_thread, menu_detection_thread, armament_detection_thread, replace_armament_detection_thread, root
     with enabled_lock:
         enabled = not enabled
         if enabled:
             # Restart threads if they are not alive
+            if not capture_thread.is_alive():
+                capture_thread = CaptureThread(frame_bus=frame_bus, daemon=True)
+                capture_thread.start()
             with character_detection_enabled_lock:
                 if character_detection_enabled and not character_detection_thread.is_alive():
                     character_detection_thread = DetectionThread(detection_id=CHARACTER_DETECTION, function=detect_character, daemon=True)
@@ -477,6 +581,8 @@ def toggle_enabled() -> None:
             root.deiconify()
         else:
             # Stop threads
+            if capture_thread.is_alive():
+                capture_thread.stop()
             if character_detection_thread.is_alive():
                 character_detection_thread.stop()
             if menu_detection_thread.is_alive():
@@ -600,139 +706,207 @@ def create_control_window() -> Toplevel:
 
 
 # Separate check_confirm_button into two functions to improve readability and maintainability.
-def find_button(img: Image.Image) -> bool:
-    resolution = f"{img.width}x{img.height}"
-    img_np = array(img)
-    gray = cvtColor(img_np, COLOR_BGR2GRAY)
-
-    for button_type in BUTTON_TYPES:
-        for geometry_type in BUTTON_GEOMETRY_TYPES:
-            top, bottom, left, right = get_button_coordinates(img.width, img.height, geometry_type)
-            comp_img_np = gray[top:bottom, left:right]
-            dimensions = (comp_img_np.shape[1], comp_img_np.shape[0])
-            mask_path = path.join(RESOURCES_PATH, "buttons", f"{geometry_type}_mask.png")
-            mask_np = array(IMAGE_CACHE.get_image(mask_path))
-            mask_np = resize(mask_np, dimensions, interpolation=INTER_AREA)
-
-            for controller_type in CONTROLLER_TYPES_BY_BUTTON_GEOMETRY[geometry_type]:
-                ref_img_path = path.join(RESOURCES_PATH, "buttons", f"{button_type}_{controller_type}.png")
-                ref_img_np = array(IMAGE_CACHE.get_image(ref_img_path))
-                ref_img_np = resize(ref_img_np, dimensions, interpolation=INTER_AREA)
-
-                comp_img_np = bitwise_and(comp_img_np, mask_np)
-                ref_img_np = bitwise_and(ref_img_np, mask_np)
-
-                found: bool = not are_images_different(ref_img_np, comp_img_np, 15)
-                if found:
-                    DEBUG_WINDOW.found_button(button_type, geometry_type, img.width, img.height)
-                    return True
+def find_button(frame: CaptureFrame) -> bool:
+    for geometry_type, templates in button_template_bank.get_templates(frame.width, frame.height).items():
+        top, bottom, left, right = templates.coordinates
+        comp_img_np = frame.crop(top, bottom, left, right)
+        if comp_img_np is None:
+            continue
+        comp_hash = get_image_hash(bitwise_and(comp_img_np, templates.mask))
+        for button_type, controller_type, ref_hash in templates.references:
+            found: bool = get_hash_difference(ref_hash, comp_hash) < 15
+            if found:
+                DEBUG_WINDOW.found_button(button_type, geometry_type, frame.width, frame.height)
+                return True
     return False
 
 
-def get_screen_grab() -> Image.Image:
-    global last_screengrab, last_screengrab_time, screengrab_lock, screen_width_real, screen_height_real
-    with screengrab_lock:
-        current_time = time()
-        if current_time - last_screengrab_time >= MINIMUM_TIME_BETWEEN_SCREENGRABS or last_screengrab is None:
-            last_screengrab = ImageGrab.grab()
-            last_screengrab_time = current_time
-            if last_screengrab.width != screen_width_real or last_screengrab.height != screen_height_real:
-                # Update the real screen dimensions if they have changed
-                screen_width_real = last_screengrab.width
-                screen_height_real = last_screengrab.height
-        return last_screengrab
+def get_active_capture_regions(screen_width: int, screen_height: int) -> list[tuple[int, int, int, int]]:
+    global capture_regions, capture_regions_key
+    with current_menu_state_lock:
+        menu_state = current_menu_state
+    with character_detection_enabled_lock:
+        character_detection_active = character_detection_enabled
+    # The regions only depend on the resolution and on which detection boxes are active, so they are only recomputed when those change.
+    key = (screen_width, screen_height, menu_state, character_detection_active)
+    if key != capture_regions_key:
+        detection_ids: list[str] = [MENU_DETECTION]
+        if character_detection_active:
+            detection_ids.append(CHARACTER_DETECTION)
+        for detection_id in [ARMAMENT_DETECTION_DEFAULT, ARMAMENT_DETECTION_DEFAULT_REPLACE]:
+            eff_detection_id = get_eff_detection_id(detection_id)
+            if eff_detection_id is not None:
+                detection_ids.append(eff_detection_id)
+        capture_regions = get_capture_regions(detection_ids, screen_width, screen_height)
+        capture_regions_key = key
+    return capture_regions
+
+
+def capture_frame(sequence: int) -> CaptureFrame | None:
+    global screen_width_real, screen_height_real
+    current_time = time()
+    frame: CaptureFrame
+    if CAPTURE_MODE == CAPTURE_MODE_REGION:
+        # The source tells the screen dimensions before the regions are grabbed, so resolution changes need no full screen grab
+        grabbed = frame_source.grab_regions(get_active_capture_regions)
+        if grabbed is None:
+            return None
+        screen_width, screen_height, regions = grabbed
+        frame = CaptureFrame(sequence, current_time, regions, screen_width, screen_height)
+    else:
+        img = frame_source.grab()
+        if img is None:
+            return None
+        frame = CaptureFrame.full(sequence, current_time, img)
+    if frame.width != screen_width_real or frame.height != screen_height_real:
+        # Update the real screen dimensions if they have changed
+        screen_width_real = frame.width
+        screen_height_real = frame.height
+    return frame
+
+
+def get_latest_frame() -> CaptureFrame | None:
+    # Detectors read the most recent frame published by the capture thread, waiting briefly for the first one
+    frame = frame_bus.latest()
+    if frame is None:
+        frame = frame_bus.wait_for_frame(timeout=MINIMUM_TIME_BETWEEN_SCREENGRABS * 10)
+    return frame
 
 
 def get_eff_detection_id(detection_id: str) -> str | None:
     global current_menu_state, current_menu_state_lock
-    if detection_id == ARMAMENT_DETECTION_DEFAULT_REPLACE:
-        with current_menu_state_lock:
-            if current_menu_state == MENU_STATE_DEFAULT:
-                return ARMAMENT_DETECTION_DEFAULT_REPLACE
-            else:
-                return None
-    elif detection_id == ARMAMENT_DETECTION_DEFAULT:
-        with current_menu_state_lock:
-            if current_menu_state == MENU_STATE_DEFAULT:
-                return ARMAMENT_DETECTION_DEFAULT
-            elif current_menu_state == MENU_STATE_SHOP:
-                return ARMAMENT_DETECTION_SHOP
-            elif current_menu_state == MENU_STATE_DORMANT_POWER:
-                return ARMAMENT_DETECTION_BOSS_DROP
-    return detection_id
-
-
-def get_cropped_area(box_identifier: str) -> ndarray | None:
-    global button_detection_required
-    img = get_screen_grab()
-    try:
-        button_detected: bool = find_button(img)
-        if button_detection_required and not button_detected:
-            return None
-        elif not button_detection_required and button_detected:
-            # The first time that we detect one of the buttons in question, we enable the "detection_required" flag,
-            # so that we can start preventing the OCR from running when it's not necessary.
-            button_detection_required = True
-    except Exception as e:
-        log_error(e, fatal=False)
-        # Ignore error and continue as normal
+    with current_menu_state_lock:
+        return get_effective_detection_id(detection_id, current_menu_state)
+
+
+def is_button_check_passed(frame: CaptureFrame) -> bool:
+    global button_detection_required, button_check_sequence, button_check_passed
+    # The verdict only depends on the frame, so it is computed once per frame and shared by every detector.
+    with button_check_lock:
+        if frame.sequence == button_check_sequence:
+            return button_check_passed
+        button_check_passed = True
+        try:
+            button_detected: bool = find_button(frame)
+            if button_detection_required and not button_detected:
+                button_check_passed = False
+            elif not button_detection_required and button_detected:
+                # The first time that we detect one of the buttons in question, we enable the "detection_required" flag,
+                # so that we can start preventing the OCR from running when it's not necessary.
+                button_detection_required = True
+        except Exception as e:
+            log_error(e, fatal=False)
+            # Ignore error and continue as normal
+        button_check_sequence = frame.sequence
+        return button_check_passed
+
+
+def get_cropped_area(frame: CaptureFrame, box_identifier: str) -> ndarray | None:
+    if not is_button_check_passed(frame):
+        return None
 
-    img_np = array(img)
-    gray = cvtColor(img_np, COLOR_BGR2GRAY)
+    top, bottom, left, right = get_detection_box_coordinates(box_identifier, frame.width, frame.height)
+    # May be None if the frame was captured for a region that does not contain this detection box (ex: right after a menu change)
+    return frame.crop(top, bottom, left, right)
 
-    width, height = img.size
-    top, bottom, left, right = get_detection_box_coordinates(box_identifier, width, height)
-    return gray[top:bottom, left:right]
 
+def get_selected_language() -> str:
+    with selected_language_lock:
+        return selected_language
 
-def detect_text(detection_id: str) -> tuple[int, str]:
-    global previous_armament_img, previous_armament_name, last_armament_pixel_set, last_replace_armament_pixel_set, previous_replace_armament_img, previous_replace_armament_name, current_menu_state, current_menu_state_lock, pixelset_cache, screen_width_real, screen_height_real, previous_imgs_lock, previous_matches_lock, last_pixelsets_lock, previous_imgs, previous_matches, last_pixelsets, DEBUG_WINDOW
+
+def wait_for_ocr(job: OcrJob, eff_detection_id: str, frame: CaptureFrame, cropped_hash: ndarray) -> str | None:
+    # Waits for the OCR result, unless the detection box changes in a newer frame in the meantime (then returns None)
+    while True:
+        try:
+            return job.future.result(timeout=OCR_WAIT_SLICE)
+        except FutureTimeoutError:
+            pass
+        except CancelledError:  # The pool is shutting down
+            return None
+        latest_frame = get_latest_frame()
+        if latest_frame is None or latest_frame.sequence == frame.sequence:
+            continue
+        cropped = get_cropped_area(latest_frame, eff_detection_id)
+        if cropped is None or are_hashes_different(cropped_hash, get_image_hash(cropped)):
+            ocr_pool.abandon(job)
+            return None
+        frame = latest_frame
+
+
+def detect_text(detection_id: str, language: str) -> tuple[int, str]:
+    global current_menu_state, current_menu_state_lock, pixelset_cache, previous_imgs_lock, previous_matches_lock, last_pixelsets_lock, previous_imgs, previous_hashes, previous_matches, last_pixelsets, DEBUG_WINDOW
 
     # Get a more specific detection ID if necessary, for example, due to the current menu state.
     eff_detection_id = get_eff_detection_id(detection_id)
     if eff_detection_id is None:
         return (TEXT_ORIGIN_NONE, "")
 
-    cropped = get_cropped_area(eff_detection_id)
+    frame = get_latest_frame()
+    if frame is None:
+        return (TEXT_ORIGIN_NONE, "")
+    cropped = get_cropped_area(frame, eff_detection_id)
     if cropped is None:
+        DETECTION_STATS.record(eff_detection_id, DETECTION_OUTCOME_SKIPPED)
         return (TEXT_ORIGIN_NONE, "")
-    _, img_for_ocr = threshold(cropped, 115, 255, THRESH_BINARY_INV)
+    img_for_ocr: ndarray = get_ocr_image(cropped)
 
     # To avoid unnecessary processing, we check if the image has changed since the last detection.
+    cropped_hash: ndarray = get_image_hash(cropped)
+    # The hash is only a cheap first filter, different texts may have the same hash, so the image itself must be identical too.
     with previous_imgs_lock, previous_matches_lock:
-        if not are_images_different(previous_imgs[eff_detection_id], cropped):
+        previous_img: ndarray | None = previous_imgs[eff_detection_id]
+        if not are_hashes_different(previous_hashes[eff_detection_id], cropped_hash) and previous_img is not None and array_equal(previous_img, img_for_ocr):
+            DETECTION_STATS.record(eff_detection_id, DETECTION_OUTCOME_UNCHANGED)
             return previous_matches[eff_detection_id]
 
     # To save time and resources in future detection of the same armament, we generate a pixel set
     # and check if it matches any of the previously saved pixel sets.
-    pixel_set: PixelSet = PixelSet(pixelset_cache, cropped, screen_width_real, screen_height_real, eff_detection_id)
+    pixel_set: PixelSet = PixelSet(pixelset_cache, cropped, eff_detection_id)
     pixel_set_match = pixel_set.find_match(eff_detection_id)
     if pixel_set_match != "":
         DEBUG_WINDOW.matched_pixelset(eff_detection_id, pixel_set_match)
+        DETECTION_STATS.record(eff_detection_id, DETECTION_OUTCOME_PIXELSET)
         with previous_imgs_lock, previous_matches_lock, last_pixelsets_lock:
             previous_imgs[eff_detection_id] = img_for_ocr
+            previous_hashes[eff_detection_id] = cropped_hash
             previous_matches[eff_detection_id] = (TEXT_ORIGIN_PIXELSET, pixel_set_match)
             last_pixelsets[eff_detection_id] = None
         return (TEXT_ORIGIN_PIXELSET, pixel_set_match)
 
-    # If the detection area contains too few relevant colored pixels, we assume that the OCR will be unable to detect anything useful.
-    if pixel_set.size() / (pixel_set.width * pixel_set.height) < OCR_MINIMUM_PIXELS_PERCENTS[eff_detection_id]:
+    if not has_enough_pixels(pixel_set, eff_detection_id):
+        DETECTION_STATS.record(eff_detection_id, DETECTION_OUTCOME_SKIPPED)
         return (TEXT_ORIGIN_NONE, "")
 
-    # Character detection is stable enough that we can ditch the OCR completely if we have already learned a pixel set for each character for this resolution.
-    if eff_detection_id == CHARACTER_DETECTION and pixelset_cache.all_characters_learned(screen_width_real, screen_height_real):
+    # Character detection is stable enough that we can ditch the OCR completely if we have already learned a pixel set for each character.
+    if eff_detection_id == CHARACTER_DETECTION and pixelset_cache.all_characters_learned():
+        DETECTION_STATS.record(eff_detection_id, DETECTION_OUTCOME_SKIPPED)
         return (TEXT_ORIGIN_NONE, "")
 
     # Last resource: OCR
     DEBUG_WINDOW.begin_ocr(eff_detection_id, img_for_ocr)
-    tessdata_lang = TESSERACT_LANGUAGES[selected_language]
-    text = pytesseract.image_to_string(img_for_ocr, config=TESSERACT_CONFIG, lang=tessdata_lang, timeout=TESSERACT_TIMEOUT)
-    text = text.strip()
+    tessdata_lang = TESSERACT_LANGUAGES[language]
+    # The same image may have been read before without being learned as a pixel set (ex: the text was not a perfect match)
+    ocr_digest: bytes = get_ocr_digest(img_for_ocr, tessdata_lang)
+    ocr_text: str | None = ocr_result_cache.get(ocr_digest)
+    if ocr_text is not None:
+        DETECTION_STATS.record(eff_detection_id, DETECTION_OUTCOME_OCR_CACHE)
+    else:
+        # The pool puts the text in the result cache once read, even if this detection stops waiting for it
+        job = ocr_pool.submit(img_for_ocr, tessdata_lang, ocr_digest, (language, f"{frame.width}x{frame.height}"))
+        ocr_text = wait_for_ocr(job, eff_detection_id, frame, cropped_hash)
+        if ocr_text is None:
+            DEBUG_WINDOW.end_ocr(eff_detection_id, "")
+            DETECTION_STATS.record(eff_detection_id, DETECTION_OUTCOME_ABANDONED)
+            return (TEXT_ORIGIN_NONE, "")
+        DETECTION_STATS.record(eff_detection_id, DETECTION_OUTCOME_OCR)
+    text = ocr_text.strip()
     DEBUG_WINDOW.end_ocr(eff_detection_id, text)
 
     # Save all the relevant data for the next detection.
     with previous_imgs_lock, previous_matches_lock, last_pixelsets_lock:
         previous_imgs[eff_detection_id] = img_for_ocr
+        previous_hashes[eff_detection_id] = cropped_hash
         previous_matches[eff_detection_id] = (TEXT_ORIGIN_OCR, text)
         last_pixelsets[eff_detection_id] = pixel_set
     return (TEXT_ORIGIN_OCR, text)
@@ -768,38 +942,64 @@ class DetectionThread(Thread):
         return self._stop_event.is_set()
 
 
-def convert_menu_title_to_state(title: str) -> str:
-    if title in SHOP_LANGUAGES.values():
-        return MENU_STATE_SHOP
-    elif title in DORMANT_POWER_LANGUAGES.values():
-        return MENU_STATE_DORMANT_POWER
-    return MENU_STATE_DEFAULT
+class CaptureThread(Thread):
+    def __init__(self, frame_bus: FrameBus, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stop_event = Event()
+        self.frame_bus = frame_bus
+        self.sequence = 0
 
+    def run(self) -> None:
+        DEBUG_WINDOW.thread_started("capture")
+        while not self.is_stopped():
+            t0 = time()
+            try:
+                frame = capture_frame(self.sequence + 1)
+                if frame is not None:
+                    self.sequence = frame.sequence
+                    self.frame_bus.publish(frame)
+            except Exception as e:
+                log_error(e)
+            t1 = time()
+            sleep_time = max(0, MINIMUM_TIME_BETWEEN_SCREENGRABS - (t1 - t0))
+            sleep(sleep_time)
+        DEBUG_WINDOW.thread_stopped("capture")
 
-def learn_pixelset(detection_id: str, text_origin: int, match_result: int, match: Any, get_id: Callable) -> None:
-    # Learn the pixel set if it is a perfect match
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def is_stopped(self) -> bool:
+        return self._stop_event.is_set()
+
+
+def learn_pixelset(detection_id: str, text_origin: int, match_result: int, match: Any) -> None:
+    # Learn the pixel set if it is a perfect match (see get_pixelset_identifier, the trainer learns under the same rule)
     with last_pixelsets_lock:
         last_pixelset: PixelSet | None = last_pixelsets[detection_id]
-        if last_pixelset and text_origin == TEXT_ORIGIN_OCR and match_result == PERFECT_MATCH:
-            last_pixelset.write(get_id(match))
         last_pixelsets[detection_id] = None  # Reset the last pixel set
+    identifier: int | str | None = get_pixelset_identifier(detection_id, text_origin, match_result, match)
+    # The pixel set is only persisted in the background (see PixelSetWriter), so this does not wait for the disk.
+    if last_pixelset and identifier is not None:
+        last_pixelset.write(identifier)
 
 
 def detect_menu(detection_id: str) -> None:
     global current_menu_state, current_menu_state_lock
-    with selected_language_lock:
-        text_origin, text = detect_text(MENU_DETECTION)
-        dormant_power_title = DORMANT_POWER_LANGUAGES[selected_language]
-        shop_title = SHOP_LANGUAGES[selected_language]
-        match_result, match = find_match(detection_id, selected_language, text_origin, text, [dormant_power_title, shop_title], lambda x: x)
-        match = convert_menu_title_to_state(match) if match_result != NO_MATCH else MENU_STATE_DEFAULT
+    # The language is read once, the lock is not held during the OCR, and a result read in a language that is no longer selected is dropped
+    language = get_selected_language()
+    text_origin, text = detect_text(MENU_DETECTION, language)
+    search_space, get_text = get_search_space(MENU_DETECTION, language)
+    match_result, match = find_match(detection_id, language, text_origin, text, search_space, get_text)
+    menu_state = get_menu_state(match_result, match)
+    if language != get_selected_language():
+        return
     with current_menu_state_lock:
-        if match == current_menu_state:
+        if menu_state == current_menu_state:
             return
-        DEBUG_WINDOW.found_match(detection_id, text_origin, text, match_result, match)
-        current_menu_state = match
-        if match != MENU_STATE_DEFAULT:  # Do not learn pixelset for the default menu state (which represents the absence of a menu)
-            learn_pixelset(detection_id, text_origin, match_result, match, lambda x: x)
+        DEBUG_WINDOW.found_match(detection_id, text_origin, text, match_result, menu_state)
+        current_menu_state = menu_state
+        if menu_state != MENU_STATE_DEFAULT:  # Do not learn pixelset for the default menu state (which represents the absence of a menu)
+            learn_pixelset(detection_id, text_origin, match_result, match)
 
 
 def detect_character(detection_id: str) -> None:
@@ -807,30 +1007,30 @@ def detect_character(detection_id: str) -> None:
     with character_detection_enabled_lock:
         if not character_detection_enabled:
             return
-    with selected_language_lock:
-        text_origin, text = detect_text(detection_id)
-        match_result, match = find_match(
-            detection_id, selected_language, text_origin, text, get_all_character_specs(), lambda character_spec: character_spec["name"]
-        )
-    if match_result == NO_MATCH:
+    language = get_selected_language()
+    text_origin, text = detect_text(detection_id, language)
+    search_space, get_text = get_search_space(detection_id, language)
+    match_result, match = find_match(detection_id, language, text_origin, text, search_space, get_text)
+    if match_result == NO_MATCH or language != get_selected_language():
         return
     with current_character_id_lock:
         if match["id"] != current_character_id:
             DEBUG_WINDOW.found_match(detection_id, text_origin, text, match_result, match["name"])
             current_character_id = match["id"]
             update_current_character_dropdown(match)
-            learn_pixelset(detection_id, text_origin, match_result, match, lambda x: x["name"])
+            learn_pixelset(detection_id, text_origin, match_result, match)
 
 
 def detect_armament(detection_id: str) -> None:
     character_spec: dict | None = get_current_character_spec()
     if character_spec is None:
         return
-    with selected_language_lock:
-        text_origin, text = detect_text(detection_id)
-        match_result, match_spec = find_match(
-            detection_id, selected_language, text_origin, text, get_all_grabbable_specs(), lambda grabbable_spec: grabbable_spec["name"]
-        )
+    language = get_selected_language()
+    text_origin, text = detect_text(detection_id, language)
+    search_space, get_text = get_search_space(detection_id, language)
+    match_result, match_spec = find_match(detection_id, language, text_origin, text, search_space, get_text)
+    if language != get_selected_language():
+        return
     if match_result == NO_MATCH:
         update_armament_feedback_labels_general(detection_id)
         return
@@ -838,13 +1038,66 @@ def detect_armament(detection_id: str) -> None:
     update_armament_feedback_labels_general(detection_id, character_spec, match_spec)
     eff_detection_id = get_eff_detection_id(detection_id)
     if eff_detection_id is not None:
-        learn_pixelset(eff_detection_id, text_origin, match_result, match_spec, lambda x: x["id"])
+        learn_pixelset(eff_detection_id, text_origin, match_result, match_spec)
+
+
+def run_replay(fps: float) -> None:
+    # Drives every detector sequentially over each recorded frame, so that the results are deterministic.
+    detectors: list[tuple[str, Callable]] = [
+        (MENU_DETECTION, detect_menu),
+        (CHARACTER_DETECTION, detect_character),
+        (ARMAMENT_DETECTION_DEFAULT, detect_armament),
+        (ARMAMENT_DETECTION_DEFAULT_REPLACE, detect_armament),
+    ]
+    DETECTION_STATS.clear()
+    sequence: int = 0
+    start_time = time()
+    while True:
+        t0 = time()
+        frame = capture_frame(sequence + 1)
+        if frame is None:
+            break
+        sequence = frame.sequence
+        frame_bus.publish(frame)
+        for detection_id, function in detectors:
+            try:
+                function(detection_id)
+            except Exception as e:
+                log_error(e)
+        if fps > 0:
+            sleep(max(0, (1 / fps) - (time() - t0)))
+    elapsed = time() - start_time
+    frame_source.close()
+    print(f"Replayed {sequence} frames in {elapsed:.2f}s ({sequence / elapsed if elapsed > 0 else 0:.2f} frames/s)")
+    print(DETECTION_STATS.summary())
+
+
+def run_pixelset_compaction() -> None:
+    total_before = total_after = bytes_before = bytes_after = 0
+    for language in LANGUAGES:
+        if not path.isdir(path.join(PIXEL_SETS_PATH, language)):
+            continue
+        # Identifiers are checked against the names of the language they were learned in
+        load_all_character_specs(RESOURCES_PATH, language)
+        load_all_grabbable_specs(RESOURCES_PATH, language)
+        for name, stats in compact_pixelsets(PIXEL_SETS_PATH, language).items():
+            print(
+                f"{language}/{name}: {stats['before']} -> {stats['after']} pixel sets"
+                f" (invalid {stats['invalid']}, duplicates {stats['duplicates']}, unreachable {stats['unreachable']})"
+            )
+            total_before += stats["before"]
+            total_after += stats["after"]
+            bytes_before += stats["bytes_before"]
+            bytes_after += stats["bytes_after"]
+    removed = total_before - total_after
+    print(f"Removed {removed} of {total_before} pixel sets ({100 * removed / total_before if total_before > 0 else 0:.1f}%), {bytes_before} -> {bytes_after} bytes")
 
 
 # -------------------------- Main ------------------------------#
 
 
 if __name__ == "__main__":
+    freeze_support()  # The trainer's worker processes start from this executable when frozen
     load_configs()
     makedirs(PROGRAM_DATA_PATH, exist_ok=True)
     makedirs(TESSDATA_PATH, exist_ok=True)
@@ -853,6 +1106,69 @@ if __name__ == "__main__":
     if DEBUG:
         makedirs(DEBUG_PATH, exist_ok=True)
 
+    if COMPACT_PIXELSETS:
+        run_pixelset_compaction()
+        sys.exit(0)
+
+    if TRAIN_PATH != "":
+        if selected_language not in LANGUAGES:
+            selected_language = DEFAULT_LANGUAGE
+        download_tessdata(selected_language, TESSDATA_PATH)
+        output_path = TRAIN_OUTPUT_PATH or PIXEL_SETS_PATH
+        t0 = time()
+        stats = train_pixelsets(
+            open_frame_source(TRAIN_PATH),
+            output_path,
+            selected_language,
+            RESOURCES_PATH,
+            pytesseract.tesseract_cmd,
+            TESSDATA_PATH,
+            OCR_BACKEND,
+            TRAIN_WORKERS or None,
+        )
+        print(
+            f"Read {stats['frames']} frames ({stats['unchanged_frames']} unchanged, {stats['failed_frames']} failed) in {time() - t0:.2f}s, learned {stats['learned']} new pixel sets"
+        )
+        for detection_box_id in DETECTION_BOXES:
+            print(f"{detection_box_id}: {stats[detection_box_id]} pixel sets")
+        sys.exit(0)
+
+    if EXPORT_PIXELSET_PACK_PATH != "":
+        exported = export_pixelset_pack(PIXEL_SETS_PATH, selected_language, EXPORT_PIXELSET_PACK_PATH)
+        print(f"Exported {exported} pixel sets for '{selected_language}' to {EXPORT_PIXELSET_PACK_PATH}")
+        sys.exit(0)
+
+    if IMPORT_PIXELSET_PACK_PATH != "":
+        try:
+            imported = import_pixelset_pack(PIXEL_SETS_PATH, IMPORT_PIXELSET_PACK_PATH)
+        except (ValueError, OSError) as e:  # Unusable pack, or a file that cannot be read
+            print(f"Failed to import pixel set pack {IMPORT_PIXELSET_PACK_PATH}: {e}")
+            sys.exit(1)
+        print(f"Imported {imported} pixel sets from {IMPORT_PIXELSET_PACK_PATH}")
+        sys.exit(0)
+
+    # Only created here, so that importing this module (ex: the trainer's worker processes) does not start the OCR workers
+    ocr_result_cache = OcrResultCache(OCR_RESULT_CACHE_SIZE)
+    ocr_pool = OcrPool(create_ocr_backend(OCR_BACKEND, TESSDATA_PATH, TESSERACT_CONFIG, TESSERACT_TIMEOUT), OCR_WORKERS, ocr_result_cache)
+
+    if HEADLESS:
+        DEBUG_WINDOW = DebugWindow(None, False, DEBUG_PATH)
+        if selected_language not in LANGUAGES:
+            selected_language = DEFAULT_LANGUAGE
+        download_tessdata(selected_language, TESSDATA_PATH)
+        load_all_character_specs(RESOURCES_PATH, selected_language)
+        load_all_grabbable_specs(RESOURCES_PATH, selected_language)
+        pixelset_writer = PixelSetWriter(on_error=log_error, daemon=True)
+        pixelset_writer.start()
+        pixelset_cache = PixelSetCache(PIXEL_SETS_PATH, selected_language, DEBUG, pixelset_writer, PIXEL_SET_PACKS_PATH)
+        if PERSIST_OCR_CACHE:
+            ocr_result_cache.load(OCR_CACHE_PATH, selected_language)
+        frame_source = open_frame_source(REPLAY_PATH)
+        run_replay(REPLAY_FPS)
+        pixelset_writer.flush()
+        save_ocr_result_cache()
+        sys.exit(0)
+
     root = Tk()
     root.overrideredirect(True)
     root.attributes("-topmost", True)
@@ -898,6 +1214,7 @@ if __name__ == "__main__":
     relx += REPLACE_ARMAMENT_REL_POS_TO_NAME
     replace_advanced_armament_feedback_label.place(relx=relx, rely=rely, anchor="sw")
 
+    capture_thread = CaptureThread(frame_bus=frame_bus, daemon=True)
     character_detection_thread = DetectionThread(detection_id=CHARACTER_DETECTION, function=detect_character, daemon=True)
     menu_detection_thread = DetectionThread(detection_id=MENU_DETECTION, function=detect_menu, daemon=True)
     armament_detection_thread = DetectionThread(detection_id=ARMAMENT_DETECTION_DEFAULT, function=detect_armament, daemon=True)
@@ -919,12 +1236,17 @@ if __name__ == "__main__":
     current_character_var = StringVar(value=NO_CHARACTER)
     create_character_dropdown()
 
-    pixelset_cache = PixelSetCache(PIXEL_SETS_PATH, selected_language, DEBUG)
+    pixelset_writer = PixelSetWriter(on_error=log_error, daemon=True)
+    pixelset_writer.start()
+    pixelset_cache = PixelSetCache(PIXEL_SETS_PATH, selected_language, DEBUG, pixelset_writer, PIXEL_SET_PACKS_PATH)
+    if PERSIST_OCR_CACHE:
+        ocr_result_cache.load(OCR_CACHE_PATH, selected_language)
     update_armament_feedback_labels()
     update_current_character_dropdown(None)
     control_window = create_control_window()
     try:
         root.deiconify()
+        capture_thread.start()
         do_start: bool
         with character_detection_enabled_lock:
             do_start = character_detection_enabled
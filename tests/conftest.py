@@ -0,0 +1,5 @@
+import sys
+from os import path
+
+# The tests import the program's modules the way main.py does, from the repository root
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
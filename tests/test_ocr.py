@@ -0,0 +1,123 @@
+import json
+from threading import Event
+
+import numpy
+
+from lib.constants import *
+from lib.ocr import *
+
+
+def make_text_image(height: int, width: int, text_height: int, text_width: int) -> numpy.ndarray:
+    # Thresholded image as given to the OCR: white, with a black block standing for the text
+    img = numpy.full((height, width), 255, numpy.uint8)
+    img[5 : 5 + text_height, 20 : 20 + text_width] = 0
+    return img
+
+
+def test_prepare_ocr_image_rescales_text_to_its_height():
+    prepared = prepare_ocr_image(make_text_image(40, 400, 12, 100))
+    margin = 2 * OCR_TEXT_MARGIN
+    assert prepared.shape == (OCR_TEXT_HEIGHT + margin, 300 + margin)
+    assert (prepared[:OCR_TEXT_MARGIN] == 255).all() and (prepared[:, :OCR_TEXT_MARGIN] == 255).all()
+    assert (prepared[OCR_TEXT_MARGIN:-OCR_TEXT_MARGIN, OCR_TEXT_MARGIN:-OCR_TEXT_MARGIN] == 0).all()
+    assert set(numpy.unique(prepared)) == {0, 255}
+
+
+def test_prepare_ocr_image_bounds_the_scale():
+    margin = 2 * OCR_TEXT_MARGIN
+    assert prepare_ocr_image(make_text_image(600, 400, 400, 100)).shape == (100 + margin, 25 + margin)
+    assert prepare_ocr_image(make_text_image(20, 400, 2, 10)).shape == (2 * OCR_MAX_SCALE + margin, 10 * OCR_MAX_SCALE + margin)
+    assert prepare_ocr_image(make_text_image(60, 400, OCR_TEXT_HEIGHT, 50)).shape == (OCR_TEXT_HEIGHT + margin, 50 + margin)
+
+
+def test_prepare_ocr_image_keeps_images_without_text():
+    img = numpy.full((30, 200), 255, numpy.uint8)
+    assert prepare_ocr_image(img) is img
+
+
+def test_parse_tesseract_config():
+    psm, oem, variables = parse_tesseract_config(TESSERACT_CONFIG)
+    assert (psm, oem) == (7, 3)
+    assert variables == {"language_model_penalty_non_freq_dict_word": "1", "language_model_penalty_non_dict_word": "1", "tessedit_do_invert": "0"}
+    # Unknown arguments are skipped, and so are variables without a value
+    assert parse_tesseract_config("-l eng --psm 6 -c novalue -c a=b=c") == (6, None, {"a": "b=c"})
+    assert parse_tesseract_config("") == (None, None, {})
+
+
+def test_result_cache_round_trip(tmp_path):
+    cache = OcrResultCache(10)
+    cache.put(b"\x01", "Longsword", "engus", "1920x1080")
+    cache.put(b"\x02", "Claymore", "engus", "2560x1440")
+    cache.put(b"\x03", "Langschwert", "deude", "1920x1080")
+    cache.save(str(tmp_path))
+    assert sorted(p.name for p in (tmp_path / "engus").iterdir()) == ["1920x1080" + OCR_RESULT_CACHE_FILE_EXTENSION, "2560x1440" + OCR_RESULT_CACHE_FILE_EXTENSION]
+
+    loaded = OcrResultCache(10)
+    assert loaded.load(str(tmp_path), "engus") == 2
+    assert loaded.get(b"\x01") == "Longsword"
+    assert loaded.get(b"\x02") == "Claymore"
+    assert loaded.get(b"\x03") is None
+    # Entries keep the partition they were read from, so saving them again leaves the files as they were
+    loaded.save(str(tmp_path / "again"))
+    for resolution in ["1920x1080", "2560x1440"]:
+        filename = resolution + OCR_RESULT_CACHE_FILE_EXTENSION
+        assert json.loads((tmp_path / "again" / "engus" / filename).read_text("utf-8")) == json.loads((tmp_path / "engus" / filename).read_text("utf-8"))
+
+
+def test_result_cache_ignores_unreadable_results(tmp_path):
+    (tmp_path / "engus").mkdir()
+    (tmp_path / "engus" / ("1920x1080" + OCR_RESULT_CACHE_FILE_EXTENSION)).write_text("{not json", "utf-8")
+    (tmp_path / "engus" / ("2560x1440" + OCR_RESULT_CACHE_FILE_EXTENSION)).write_text(json.dumps({"zz": "Bad digest", "0a": "Longsword"}), "utf-8")
+    cache = OcrResultCache(10)
+    assert cache.load(str(tmp_path), "engus") == 1
+    assert cache.get(b"\x0a") == "Longsword"
+    assert cache.load(str(tmp_path), "frafr") == 0
+
+
+def test_result_cache_drops_least_recently_used():
+    cache = OcrResultCache(2)
+    cache.put(b"\x01", "a", "engus", "1920x1080")
+    cache.put(b"\x02", "b", "engus", "1920x1080")
+    cache.get(b"\x01")
+    cache.put(b"\x03", "c", "engus", "1920x1080")
+    assert cache.get(b"\x02") is None
+    assert cache.get(b"\x01") == "a" and cache.get(b"\x03") == "c"
+
+
+class BlockingOcrBackend(OcrBackend):
+    # Reads are held until released, so that the test decides which jobs are still queued
+    def __init__(self):
+        self.started: Event = Event()
+        self.release: Event = Event()
+        self.reads: int = 0
+
+    def recognize(self, img: numpy.ndarray, language: str) -> str:
+        self.started.set()
+        self.release.wait(5)
+        self.reads += 1
+        return "Longsword"
+
+
+def test_pool_caches_reads_nobody_waits_for():
+    backend = BlockingOcrBackend()
+    cache = OcrResultCache(10)
+    pool = OcrPool(backend, 1, cache)
+    first_img, second_img = numpy.full((4, 4), 1, numpy.uint8), numpy.full((4, 4), 2, numpy.uint8)
+    first = pool.submit(first_img, "eng", cache_partition=("engus", "1920x1080"))
+    shared = pool.submit(first_img, "eng", cache_partition=("engus", "1920x1080"))
+    second = pool.submit(second_img, "eng", cache_partition=("engus", "1920x1080"))
+    assert shared is first and first.waiters == 2
+    # The second job is still queued behind the first one, so abandoning it cancels it
+    pool.abandon(second)
+    assert second.future.cancelled() and second.digest not in pool.jobs
+    # The first one is running, abandoning it does not stop it, and its text is still cached
+    assert backend.started.wait(5)
+    pool.abandon(first)
+    pool.abandon(shared)
+    backend.release.set()
+    pool.shutdown()
+    pool.executor.shutdown(wait=True)
+    assert backend.reads == 1
+    assert cache.get(first.digest) == "Longsword"
+    assert cache.get(second.digest) is None
+    assert pool.jobs == {}
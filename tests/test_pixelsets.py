@@ -0,0 +1,163 @@
+import json
+from zipfile import ZipFile
+
+import numpy
+import pytest
+
+from lib.constants import *
+from lib.pixelsets import *
+
+
+def make_pixelset(shape: tuple[int, int], top: int, left: int, height: int, width: int) -> numpy.ndarray:
+    # Packed bitmap of the given shape with a single lit rectangle, given in fractions of 1000 of the shape
+    bitmap = numpy.zeros(shape, dtype=bool)
+    y, x = shape[0] * top // 1000, shape[1] * left // 1000
+    bitmap[y : y + max(1, shape[0] * height // 1000), x : x + max(1, shape[1] * width // 1000)] = True
+    return pack_bitmap(bitmap)
+
+
+def save_group(filepath: str, shape: tuple[int, int], pixelsets: dict) -> None:
+    group = PixelSetGroup(shape, filepath)
+    for identifier, pixelset in pixelsets.items():
+        group.set(identifier, pixelset)
+    group.save()
+
+
+def test_save_and_read_round_trip(tmp_path):
+    shape = get_canonical_pixelset_shape(ARMAMENT_DETECTION_DEFAULT)
+    pixelsets = {2000000: make_pixelset(shape, 100, 0, 800, 300), "i100": make_pixelset(shape, 200, 400, 600, 200)}
+    filepath = str(tmp_path / ("group" + PIXELSET_FILE_EXTENSION))
+    save_group(filepath, shape, pixelsets)
+    group = PixelSetGroup.load(filepath, shape)
+    # Identifiers keep their type (armament ids are integers)
+    assert list(group.pixelsets) == [2000000, "i100"]
+    for identifier, pixelset in pixelsets.items():
+        assert numpy.array_equal(group.pixelsets[identifier], pixelset)
+    group.release_mapping()
+
+
+def test_read_rejects_other_shapes_and_formats(tmp_path):
+    shape = get_canonical_pixelset_shape(MENU_DETECTION)
+    filepath = str(tmp_path / ("group" + PIXELSET_FILE_EXTENSION))
+    save_group(filepath, shape, {"Shop": make_pixelset(shape, 0, 0, 500, 500)})
+    with open(filepath, "rb") as file:
+        data = file.read()
+    assert len(read_pixelsets(data, shape)) == 1
+    assert read_pixelsets(data, (shape[0] + 1, shape[1])) == {}
+    assert read_pixelsets(b"XXXX" + data[4:], shape) == {}
+    assert read_pixelsets(data[: len(data) - 1], shape) == {}
+    assert read_pixelsets(data[:4], shape) == {}
+
+
+def test_migrate_legacy_pixelsets(tmp_path):
+    detection_box_path = tmp_path / DEFAULT_LANGUAGE / PIXELSET_CANONICAL_RESOLUTION / ARMAMENT_DETECTION_DEFAULT
+    detection_box_path.mkdir(parents=True)
+    (detection_box_path / ("2000000" + LEGACY_PIXELSET_FILE_EXTENSION)).write_text("\n".join(f"{x} 5" for x in range(20)))
+    (detection_box_path / ("2000100" + LEGACY_PIXELSET_FILE_EXTENSION)).write_text("1 1\n2 2")  # Too few pixels to be kept
+    migrate_legacy_pixelsets(str(tmp_path))
+    assert not detection_box_path.exists()
+    shape = get_canonical_pixelset_shape(ARMAMENT_DETECTION_DEFAULT)
+    group = PixelSetGroup.load(str(detection_box_path) + PIXELSET_FILE_EXTENSION, shape)
+    # Legacy file names hold the armament ids as text
+    assert list(group.pixelsets) == [2000000]
+    bitmap = unpack_bitmap(group.pixelsets[2000000], shape)
+    assert bitmap.sum() == 20 and bitmap[5, :20].all()
+    group.release_mapping()
+
+
+def test_migrate_pixelsets_to_canonical(tmp_path):
+    lang_path = tmp_path / DEFAULT_LANGUAGE
+    canonical_shape = get_canonical_pixelset_shape(ARMAMENT_DETECTION_DEFAULT)
+    filename = ARMAMENT_DETECTION_DEFAULT + PIXELSET_FILE_EXTENSION
+    large_shape = get_pixelset_shape("3840x2160", ARMAMENT_DETECTION_DEFAULT)
+    small_shape = get_pixelset_shape("1280x720", ARMAMENT_DETECTION_DEFAULT)
+    large = make_pixelset(large_shape, 0, 0, 500, 500)
+    save_group(str(lang_path / "3840x2160" / filename), large_shape, {2000000: large})
+    small = {2000000: make_pixelset(small_shape, 500, 500, 500, 500), 2000100: make_pixelset(small_shape, 0, 500, 1000, 100)}
+    save_group(str(lang_path / "1280x720" / filename), small_shape, small)
+    existing = make_pixelset(canonical_shape, 0, 0, 1000, 1000)
+    save_group(str(lang_path / PIXELSET_CANONICAL_RESOLUTION / filename), canonical_shape, {2000100: existing})
+
+    migrate_pixelsets_to_canonical(str(tmp_path))
+
+    assert sorted(path.name for path in lang_path.iterdir()) == [PIXELSET_CANONICAL_RESOLUTION]
+    group = PixelSetGroup.load(str(lang_path / PIXELSET_CANONICAL_RESOLUTION / filename), canonical_shape)
+    assert sorted(group.pixelsets) == [2000000, 2000100]
+    # The pixel set learned at the highest resolution wins, and the ones already at the canonical resolution are kept
+    assert numpy.array_equal(group.pixelsets[2000000], rescale_pixelset(large, large_shape, canonical_shape))
+    assert numpy.array_equal(group.pixelsets[2000100], existing)
+    group.release_mapping()
+
+
+def test_export_and_import_pack(tmp_path):
+    shape = get_canonical_pixelset_shape(ARMAMENT_DETECTION_DEFAULT)
+    pixelsets = {2000000: make_pixelset(shape, 100, 0, 800, 300), 2000100: make_pixelset(shape, 200, 400, 600, 200)}
+    filename = ARMAMENT_DETECTION_DEFAULT + PIXELSET_FILE_EXTENSION
+    save_group(str(tmp_path / "source" / DEFAULT_LANGUAGE / PIXELSET_CANONICAL_RESOLUTION / filename), shape, pixelsets)
+    pack_path = str(tmp_path / "pack.zip")
+    assert export_pixelset_pack(str(tmp_path / "source"), DEFAULT_LANGUAGE, pack_path) == 2
+    # Pixel sets already learned are kept
+    target_filepath = str(tmp_path / "target" / DEFAULT_LANGUAGE / PIXELSET_CANONICAL_RESOLUTION / filename)
+    existing = make_pixelset(shape, 0, 0, 1000, 1000)
+    save_group(target_filepath, shape, {2000100: existing})
+    assert import_pixelset_pack(str(tmp_path / "target"), pack_path) == 1
+    group = PixelSetGroup.load(target_filepath, shape)
+    assert numpy.array_equal(group.pixelsets[2000000], pixelsets[2000000])
+    assert numpy.array_equal(group.pixelsets[2000100], existing)
+    group.release_mapping()
+
+
+def write_pack(pack_path: str, manifest, files: dict[str, bytes] | None = None) -> None:
+    with ZipFile(pack_path, "w") as pack:
+        if manifest is not None:
+            pack.writestr(PIXELSET_PACK_MANIFEST, manifest if isinstance(manifest, str) else json.dumps(manifest))
+        for filename, data in (files or {}).items():
+            pack.writestr(filename, data)
+
+
+def get_manifest(**changes) -> dict:
+    manifest = {
+        "format": PIXELSET_PACK_FORMAT,
+        "language": DEFAULT_LANGUAGE,
+        "resolution": PIXELSET_CANONICAL_RESOLUTION,
+        "detection_boxes": {ARMAMENT_DETECTION_DEFAULT: 1},
+    }
+    manifest.update(changes)
+    return manifest
+
+
+@pytest.mark.parametrize(
+    "manifest, files",
+    [
+        (None, {}),  # No manifest
+        ("{not json", {}),
+        ([1, 2], {}),  # Not an object
+        (get_manifest(format=PIXELSET_PACK_FORMAT + 1), {}),
+        (get_manifest(language="../../outside"), {}),
+        (get_manifest(resolution="0x0"), {}),
+        (get_manifest(resolution="../1920x1080"), {}),
+        (get_manifest(resolution=1080), {}),
+        (get_manifest(detection_boxes=5), {}),
+        (get_manifest(), {}),  # Listed pixel set file missing
+    ],
+)
+def test_import_rejects_unusable_packs(tmp_path, manifest, files):
+    pack_path = str(tmp_path / "pack.zip")
+    write_pack(pack_path, manifest, files)
+    with pytest.raises(ValueError):
+        import_pixelset_pack(str(tmp_path / "target"), pack_path)
+    assert not (tmp_path / "target").exists()
+
+
+def test_import_rejects_files_that_are_not_packs(tmp_path):
+    pack_path = tmp_path / "pack.zip"
+    pack_path.write_bytes(b"not a zip file")
+    with pytest.raises(ValueError):
+        import_pixelset_pack(str(tmp_path / "target"), str(pack_path))
+
+
+def test_import_skips_unknown_detection_boxes(tmp_path):
+    pack_path = str(tmp_path / "pack.zip")
+    write_pack(pack_path, get_manifest(detection_boxes=["../outside", 5]))
+    assert import_pixelset_pack(str(tmp_path / "target"), pack_path) == 0
+    assert not (tmp_path / "target").exists()
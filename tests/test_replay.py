@@ -0,0 +1,102 @@
+import cv2
+import numpy
+import pytest
+from PIL import Image
+
+import main
+from lib.capture import FrameBus, open_frame_source
+from lib.constants import *
+from lib.debug import DebugWindow
+from lib.misc import DETECTION_STATS, MATCH_CACHE, get_detection_box_coordinates
+from lib.ocr import OcrBackend, OcrPool, OcrResultCache
+from lib.pixelsets import PixelSetCache, PixelSetWriter
+
+SCREEN_WIDTH, SCREEN_HEIGHT = 1920, 1080
+
+
+class ReplayOcrBackend(OcrBackend):
+    # Reads the name drawn in the frame being replayed, the replay runs the detectors of one frame at a time
+    def __init__(self, names: list[str]):
+        self.names: list[str] = names
+        self.reads: list[str] = []
+
+    def recognize(self, img: numpy.ndarray, language: str) -> str:
+        name = self.names[main.frame_bus.latest().sequence - 1]
+        self.reads.append(name)
+        return name
+
+
+def write_frames(frames_path, names: list[str]) -> None:
+    # One frame per name, with the name drawn in the default armament box (empty names leave the frame black)
+    top, bottom, left, right = get_detection_box_coordinates(ARMAMENT_DETECTION_DEFAULT, SCREEN_WIDTH, SCREEN_HEIGHT)
+    frames_path.mkdir()
+    for i, name in enumerate(names):
+        img = numpy.zeros((SCREEN_HEIGHT, SCREEN_WIDTH, 3), numpy.uint8)
+        if name != "":
+            cv2.putText(img, name.upper(), (left + 5, bottom - 8), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (230, 230, 230), 2)
+        Image.fromarray(img).save(frames_path / f"{i:03d}.png")
+
+
+@pytest.fixture
+def replay(tmp_path, monkeypatch):
+    # Sets up main.py as its headless branch does, with the OCR replaced and every path under tmp_path
+    def run(names: list[str], capture_mode: str = CAPTURE_MODE_REGION) -> ReplayOcrBackend:
+        write_frames(tmp_path / "frames", names)
+        backend = ReplayOcrBackend(names)
+        writer = PixelSetWriter(daemon=True)
+        writer.start()
+        monkeypatch.setattr(main, "HEADLESS", True)
+        monkeypatch.setattr(main, "CAPTURE_MODE", capture_mode)
+        monkeypatch.setattr(main, "DEBUG_WINDOW", DebugWindow(None, False, str(tmp_path / "debug")), raising=False)
+        monkeypatch.setattr(main, "selected_language", DEFAULT_LANGUAGE)
+        monkeypatch.setattr(main, "current_menu_state", MENU_STATE_DEFAULT)
+        monkeypatch.setattr(main, "current_character_id", main.get_all_character_specs()[0]["id"])
+        monkeypatch.setattr(main, "capture_regions_key", None)
+        monkeypatch.setattr(main, "button_detection_required", False)
+        monkeypatch.setattr(main, "button_check_sequence", -1)
+        monkeypatch.setattr(main, "frame_bus", FrameBus())
+        monkeypatch.setattr(main, "frame_source", open_frame_source(str(tmp_path / "frames")))
+        monkeypatch.setattr(main, "pixelset_writer", writer, raising=False)
+        monkeypatch.setattr(main, "pixelset_cache", PixelSetCache(str(tmp_path / "pixel_sets"), DEFAULT_LANGUAGE, False, writer), raising=False)
+        monkeypatch.setattr(main, "ocr_result_cache", OcrResultCache(OCR_RESULT_CACHE_SIZE), raising=False)
+        monkeypatch.setattr(main, "ocr_pool", OcrPool(backend, 1, main.ocr_result_cache), raising=False)
+        main.reset_previous_detections()
+        MATCH_CACHE.clear()
+        main.run_replay(0)
+        main.ocr_pool.shutdown()
+        writer.stop()
+        return backend
+
+    main.load_all_character_specs(main.RESOURCES_PATH, DEFAULT_LANGUAGE)
+    main.load_all_grabbable_specs(main.RESOURCES_PATH, DEFAULT_LANGUAGE)
+    return run
+
+
+@pytest.mark.parametrize("capture_mode", CAPTURE_MODES)
+def test_replay_reads_each_new_armament_once(replay, capture_mode):
+    backend = replay(["Longsword", "Claymore", "Claymore", "Longsword", ""], capture_mode)
+    # Longsword and Claymore are read by the OCR and learned, the repeated Claymore is unchanged, and Longsword is then found by its pixel set
+    assert backend.reads == ["Longsword", "Claymore"]
+    counts = DETECTION_STATS.counts
+    assert counts[ARMAMENT_DETECTION_DEFAULT] == {
+        DETECTION_OUTCOME_SKIPPED: 1,
+        DETECTION_OUTCOME_UNCHANGED: 1,
+        DETECTION_OUTCOME_PIXELSET: 1,
+        DETECTION_OUTCOME_OCR: 2,
+        DETECTION_OUTCOME_OCR_CACHE: 0,
+        DETECTION_OUTCOME_ABANDONED: 0,
+    }
+    # Nothing is drawn in the other boxes
+    for detection_id in [MENU_DETECTION, CHARACTER_DETECTION, ARMAMENT_DETECTION_DEFAULT_REPLACE]:
+        assert counts[detection_id][DETECTION_OUTCOME_SKIPPED] == 5
+        assert sum(counts[detection_id].values()) == 5
+
+
+def test_replay_uses_ocr_cache_for_unlearned_text(replay):
+    # A misread is never learned as a pixel set, so it is read from the OCR result cache when it comes back
+    backend = replay(["Longswrod", "Claymore", "Longswrod"])
+    assert backend.reads == ["Longswrod", "Claymore"]
+    counts = DETECTION_STATS.counts[ARMAMENT_DETECTION_DEFAULT]
+    assert counts[DETECTION_OUTCOME_OCR] == 2
+    assert counts[DETECTION_OUTCOME_OCR_CACHE] == 1
+    assert counts[DETECTION_OUTCOME_PIXELSET] == 0
@@ -0,0 +1,99 @@
+import random
+from collections import Counter
+from os import path
+
+import pytest
+
+from lib.armaments import load_all_grabbable_specs, get_all_grabbable_specs
+from lib.characters import load_all_character_specs, get_all_character_specs
+from lib.constants import *
+from lib.misc import find_match
+from lib.text import *
+
+RESOURCES_PATH = path.join(path.dirname(path.dirname(path.abspath(__file__))), "resources")
+
+
+def get_similarity(a: Counter, b: Counter) -> float:
+    # Jaccard similarity of the characters of both texts, as multisets, computed the way textdistance did
+    intersection = sum((a & b).values())
+    union = sum((a | b).values())
+    return 1 - (1 - intersection / union) if union > 0 else 1.0
+
+
+def find_match_by_scan(detection_id: str, language: str, text: str, targets: list, exhaustive: bool = True):
+    # The matching as it was before the text match index: every item scored in order.
+    # targets are the (item, normalized text, characters of the normalized text) of every item, in order.
+    threshold = TEXT_SIMILARITY_THRESHOLDS[detection_id]
+    clean_text = normalize_ocr_text(text, language)
+    characters = Counter(clean_text)
+    best_match, best_similarity = None, 0.0
+    for item, clean_item_text, item_characters in targets:
+        similarity = get_similarity(characters, item_characters)
+        if similarity < threshold:
+            continue
+        if clean_text == clean_item_text:
+            return (PERFECT_MATCH, item)
+        if not exhaustive:
+            return (GOOD_MATCH, item)
+        if similarity > best_similarity:
+            best_match, best_similarity = item, similarity
+    return (GOOD_MATCH, best_match) if best_match is not None else (NO_MATCH, None)
+
+
+def get_misreads(names: list[str], count: int) -> list[str]:
+    # Names with the kind of mistakes the OCR makes: dropped, swapped, replaced and added characters, and stray symbols
+    rng = random.Random(0)
+    texts: list[str] = []
+    for _ in range(count):
+        characters = list(rng.choice(names))
+        for _ in range(rng.randint(0, 3)):
+            mistake = rng.randrange(4)
+            position = rng.randrange(len(characters) + 1)
+            if mistake == 0 and position < len(characters):
+                del characters[position]
+            elif mistake == 1 and position + 1 < len(characters):
+                characters[position], characters[position + 1] = characters[position + 1], characters[position]
+            elif mistake == 2 and position < len(characters):
+                characters[position] = rng.choice("ILl1!|O0e+ ")
+            else:
+                characters.insert(position, rng.choice("aeirst'-.[]"))
+        texts.append("".join(characters))
+    return texts + ["", " ", "123", "[]"]
+
+
+@pytest.mark.parametrize("language", [DEFAULT_LANGUAGE, "deude", "jpnjp"])
+@pytest.mark.parametrize("exhaustive", [True, False])
+def test_index_matches_scan(language, exhaustive):
+    load_all_grabbable_specs(RESOURCES_PATH, language)
+    load_all_character_specs(RESOURCES_PATH, language)
+    search_spaces = [
+        (ARMAMENT_DETECTION_DEFAULT, get_all_grabbable_specs(), get_spec_name),
+        (CHARACTER_DETECTION, get_all_character_specs(), get_spec_name),
+        (MENU_DETECTION, [DORMANT_POWER_LANGUAGES[language], SHOP_LANGUAGES[language]], get_text_itself),
+    ]
+    for detection_id, items, get_text in search_spaces:
+        names = [get_text(item) for item in items]
+        targets = [(item, normalize_target_text(name, language), Counter(normalize_target_text(name, language))) for item, name in zip(items, names)]
+        for text in get_misreads(names, 100) + names[:20]:
+            expected = find_match_by_scan(detection_id, language, text, targets, exhaustive)
+            match_result, match = find_match(detection_id, language, TEXT_ORIGIN_OCR, text, items, get_text, exhaustive)
+            if text == "":
+                assert (match_result, match) == (NO_MATCH, None)
+                continue
+            assert match_result == expected[0], text
+            assert match is expected[1], text  # Identity, as several items may share a name
+
+
+def test_index_ties_keep_the_first_text():
+    index = TextMatchIndex(["AB", "BA", "ABC"], DEFAULT_LANGUAGE)
+    assert index.find("AB", 0.5) == (PERFECT_MATCH, 0)
+    assert index.find("BA", 0.5) == (PERFECT_MATCH, 1)
+    assert index.find("ABD", 0.5) == (GOOD_MATCH, 0)
+    assert index.find("ABD", 0.5, exhaustive=False) == (GOOD_MATCH, 0)
+    assert index.find("XYZ", 0.5) == (NO_MATCH, -1)
+
+
+def test_index_normalizes_its_texts():
+    index = TextMatchIndex(["  Épée  ", "Longsword [2]"], DEFAULT_LANGUAGE)
+    assert index.texts == ["EPEE", "LONGSWORD "]
+    assert index.find(normalize_ocr_text("Longsword", DEFAULT_LANGUAGE), 0.5) == (GOOD_MATCH, 1)